@@ -0,0 +1,122 @@
+"""Бенчмарк стоимости обращений к БД на одно групповое сообщение.
+
+Сравнивает старую схему "соединение на каждый вызов" с долгоживущими
+соединениями Database для upsert_user_profiles, get_global_autoresponder и get_block_totals.
+
+Запуск: python benchmarks/bench_database.py [--messages 5000]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+
+os.environ.setdefault("BOT_TOKEN", "123456:" + "A" * 35)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+WORK_DIR = tempfile.mkdtemp(prefix="joyguard-bench-")
+os.chdir(WORK_DIR)
+
+import joyguard  # noqa: E402
+
+
+class ConnectPerCallDatabase(joyguard.Database):
+    """Поведение до перехода на долгоживущие соединения: соединение на каждый вызов."""
+
+    def __init__(self, db_name: str):
+        self._call_connections: list[sqlite3.Connection] = []
+        with self.call():
+            super().__init__(db_name)
+
+    def get_connection(self):
+        conn = sqlite3.connect(self.db_name)
+        self._call_connections.append(conn)
+        return conn
+
+    @contextmanager
+    def call(self):
+        """Закрывает соединения, открытые за время вызова, как это делал старый код."""
+        try:
+            yield
+        finally:
+            connections = self._call_connections
+            self._call_connections = []
+            for conn in connections:
+                conn.close()
+
+
+def per_call(database: joyguard.Database):
+    if isinstance(database, ConnectPerCallDatabase):
+        return database.call()
+    return nullcontext()
+
+
+def seed(database: joyguard.Database, chats: int, users: int) -> None:
+    with per_call(database):
+        conn = database.get_connection()
+        for chat_id in range(chats):
+            for blocker_id in range(0, users, 7):
+                conn.execute(
+                    "INSERT OR IGNORE INTO blocks (chat_id, blocker_id, blocked_id) VALUES (?, ?, ?)",
+                    (chat_id, blocker_id, blocker_id + 1)
+                )
+        for user_id in range(0, users, 5):
+            conn.execute(
+                "INSERT OR IGNORE INTO global_autoresponders (user_id, message) VALUES (?, ?)",
+                (user_id, "не пиши мне")
+            )
+        joyguard.Database.rebuild_block_counts(conn.cursor())
+        conn.commit()
+
+
+def run_messages(database: joyguard.Database, messages: int, chats: int, users: int) -> list[float]:
+    timings: list[float] = []
+    for idx in range(messages):
+        chat_id = idx % chats
+        sender_id = idx % users
+        target_id = (idx * 31) % users
+        started = time.perf_counter()
+        with per_call(database):
+            database.upsert_user_profiles([(sender_id, f"user{sender_id}", "Имя", None)])
+        with per_call(database):
+            database.get_global_autoresponder(target_id)
+        with per_call(database):
+            database.get_block_totals(chat_id, target_id)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(label: str, timings: list[float]) -> None:
+    ordered = sorted(timings)
+    total = sum(ordered)
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(
+        f"{label:<18} {len(ordered)} msgs  total {total * 1000:8.1f} ms  "
+        f"mean {total / len(ordered) * 1e6:7.1f} us  p50 {p50 * 1e6:7.1f} us  p99 {p99 * 1e6:7.1f} us"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--users", type=int, default=500)
+    args = parser.parse_args()
+
+    legacy = ConnectPerCallDatabase(os.path.join(WORK_DIR, "legacy.db"))
+    seed(legacy, args.chats, args.users)
+    pooled = joyguard.Database(os.path.join(WORK_DIR, "pooled.db"))
+    seed(pooled, args.chats, args.users)
+
+    print(f"SQLite {sqlite3.sqlite_version}, рабочая папка {WORK_DIR}")
+    report("connect-per-call", run_messages(legacy, args.messages, args.chats, args.users))
+    report("persistent", run_messages(pooled, args.messages, args.chats, args.users))
+    pooled.close()
+
+
+if __name__ == "__main__":
+    main()
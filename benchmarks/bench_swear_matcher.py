@@ -0,0 +1,80 @@
+"""Микро-бенчмарк поиска матов на тексте, похожем на групповой чат.
+
+Сравнивает прежнюю двухшаговую схему (поиск каждого слова словаря подстрокой,
+затем токенизация WORD_PATTERN) со SwearMatcher.
+
+Запуск: python benchmarks/bench_swear_matcher.py [--messages 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123456:" + "A" * 35)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(tempfile.mkdtemp(prefix="joyguard-bench-"))
+
+import joyguard  # noqa: E402
+
+CHAT_LINES = (
+    "привет всем, кто сегодня идёт на созвон?",
+    "я опять опоздал на автобус, жесть какая-то",
+    "скиньте ссылку на вчерашний стрим пожалуйста",
+    "да ладно, это же очевидно было с самого начала",
+    "кто-нибудь знает нормальный сервис для заметок?",
+    "мне кажется он просто не понял вопрос",
+    "ну всё, я спать, завтра рано вставать",
+    "блять, опять сервер лёг посреди игры",
+    "ахахаха это лучшее что я видел за неделю",
+    "сука, кто трогал мой конфиг?!",
+    "@someone глянь личку, там важное",
+    "пиздец конечно, третий раз за день",
+    "нормально всё, не переживай",
+    "бляяяять ну почему так",
+    "х.у.й знает, спроси у админа",
+    "cyka это уже слишком",
+    "короче я пошёл за пиццей, кому взять?",
+)
+
+
+def legacy_count(text: str) -> int:
+    """Поведение process_swear_stats до SwearMatcher."""
+    lower_joined = text.lower()
+    if not any(word in lower_joined for word in joyguard.SWEAR_WORDS):
+        return 0
+    tokens = joyguard.WORD_PATTERN.findall(lower_joined)
+    return sum(1 for token in tokens if token in joyguard.SWEAR_WORDS)
+
+
+def build_messages(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.sample(CHAT_LINES, rng.randint(1, 3))) for _ in range(count)]
+
+
+def measure(label: str, func, messages: list[str]) -> int:
+    started = time.perf_counter()
+    total = 0
+    for text in messages:
+        total += func(text)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} {elapsed * 1000:8.1f} ms  {elapsed / len(messages) * 1e6:6.2f} us/msg  найдено {total}")
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    messages = build_messages(args.messages, args.seed)
+    print(f"{len(messages)} сообщений, словарь {len(joyguard.SWEAR_WORDS)} слов")
+    measure("legacy", legacy_count, messages)
+    measure("matcher", joyguard.swear_matcher.count, messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Заглушка Telegram для нагрузочной проверки webhook-режима.
+
+Поднимает фиктивный Bot API (getMe, sendMessage, getChatMember и т.п. отвечают успехом) и шлёт
+в webhook бота синтетические апдейты групповых чатов, часть из них — повторно,
+как это делает Telegram при таймауте. Печатает задержку ответа webhook и число
+вызовов Bot API, которые сделал бот.
+
+Сначала запустите заглушку (она дождётся, пока webhook начнёт отвечать):
+    python benchmarks/fake_telegram.py --secret test [--updates 2000 --concurrency 50]
+затем бота:
+    BOT_MODE=webhook WEBHOOK_SECRET=test TELEGRAM_API_URL=http://127.0.0.1:8081 python joyguard.py
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {"id": 999000, "is_bot": True, "first_name": "JoyGuard", "username": "joyguard_test_bot"}
+CHAT_LINES = (
+    "привет всем",
+    "кто сегодня на созвоне?",
+    "блять, опять сервер лёг",
+    "скиньте ссылку пожалуйста",
+    "нормально всё, не переживай",
+)
+
+api_calls: Counter = Counter()
+message_ids = iter(range(10**6, 10**9))
+
+
+async def handle_api(request: web.Request) -> web.Response:
+    method = request.match_info["method"]
+    api_calls[method] += 1
+    if method.lower() == "getme":
+        return web.json_response({"ok": True, "result": BOT_USER})
+    if method.lower() == "sendmessage":
+        data = await request.post()
+        chat_id = int(data.get("chat_id", 0))
+        result = {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "from": BOT_USER,
+            "text": data.get("text", ""),
+        }
+        return web.json_response({"ok": True, "result": result})
+    if method.lower() == "getchatmember":
+        data = await request.post()
+        user_id = int(data.get("user_id", 0))
+        member = {"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"}}
+        return web.json_response({"ok": True, "result": member})
+    return web.json_response({"ok": True, "result": True})
+
+
+def build_update(update_id: int, rng: random.Random, chats: int, users: int) -> dict:
+    chat_id = -1000000000 - rng.randrange(chats)
+    user_id = 1000 + rng.randrange(users)
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "supergroup", "title": "Load test"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        "text": rng.choice(CHAT_LINES),
+    }
+    if rng.random() < 0.3:
+        replied_id = 1000 + rng.randrange(users)
+        message["reply_to_message"] = {
+            "message_id": max(1, update_id - 1),
+            "date": int(time.time()),
+            "chat": message["chat"],
+            "from": {"id": replied_id, "is_bot": False, "first_name": f"User{replied_id}"},
+            "text": "исходное сообщение",
+        }
+    return {"update_id": update_id, "message": message}
+
+
+async def wait_for_webhook(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(url) as response:
+                    await response.read()
+                    return
+            except aiohttp.ClientConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.5)
+
+
+async def post_updates(args: argparse.Namespace) -> list[float]:
+    rng = random.Random(args.seed)
+    updates = [build_update(idx + 1, rng, args.chats, args.users) for idx in range(args.updates)]
+    # Повторная доставка части апдейтов
+    updates += rng.sample(updates, int(len(updates) * args.duplicates))
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+
+    async with aiohttp.ClientSession() as session:
+        async def send(update: dict) -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                async with session.post(args.webhook, json=update, headers=headers) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(send(update) for update in updates))
+    print(f"HTTP статусы webhook: {dict(statuses)}")
+    return latencies
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--api-host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--duplicates", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--settle", type=float, default=5.0, help="сколько ждать фоновую обработку")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", handle_api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, args.api_host, args.api_port).start()
+    print(f"Bot API заглушка: http://{args.api_host}:{args.api_port}, ждём webhook {args.webhook}")
+    await wait_for_webhook(args.webhook, args.startup_timeout)
+
+    latencies = sorted(await post_updates(args))
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{len(latencies)} запросов  p50 {p50 * 1000:.1f} ms  p99 {p99 * 1000:.1f} ms")
+    await asyncio.sleep(args.settle)
+    print(f"Вызовы Bot API от бота: {dict(api_calls)}")
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""Локальная замена Redis для проверки SHARED_STORE=redis без установки сервера.
+
+Понимает подмножество RESP2, которое использует бот: PING, AUTH, SELECT, GET,
+SET (с EX/PX), DEL, EXPIRE, TTL, DBSIZE, FLUSHDB. Данные живут в памяти процесса.
+
+Запуск: python benchmarks/resp_standin.py [--port 6379]
+Бот:    SHARED_STORE=redis REDIS_URL=redis://127.0.0.1:6379/0 python joyguard.py
+"""
+import argparse
+import asyncio
+import time
+
+databases: dict[int, dict[bytes, tuple[bytes, float | None]]] = {}
+
+
+def encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"+%s\r\n" % value.encode()
+
+
+def error(message: str) -> bytes:
+    return b"-ERR %s\r\n" % message.encode()
+
+
+def lookup(db: dict, key: bytes) -> bytes | None:
+    entry = db.get(key)
+    if entry is None:
+        return None
+    value, expires_at = entry
+    if expires_at is not None and expires_at <= time.monotonic():
+        del db[key]
+        return None
+    return value
+
+
+def execute(state: dict, args: list[bytes]) -> bytes:
+    command = args[0].upper()
+    db = databases.setdefault(state["db"], {})
+    if command == b"PING":
+        return encode("PONG")
+    if command == b"AUTH":
+        return encode("OK")
+    if command == b"SELECT":
+        state["db"] = int(args[1])
+        return encode("OK")
+    if command == b"GET":
+        return encode(lookup(db, args[1]))
+    if command == b"SET":
+        expires_at = None
+        options = [arg.upper() for arg in args[3:]]
+        for index, option in enumerate(options):
+            if option == b"EX":
+                expires_at = time.monotonic() + int(args[3 + index + 1])
+            elif option == b"PX":
+                expires_at = time.monotonic() + int(args[3 + index + 1]) / 1000
+        db[args[1]] = (args[2], expires_at)
+        return encode("OK")
+    if command == b"DEL":
+        removed = 0
+        for key in args[1:]:
+            if lookup(db, key) is not None:
+                del db[key]
+                removed += 1
+        return encode(removed)
+    if command == b"EXPIRE":
+        value = lookup(db, args[1])
+        if value is None:
+            return encode(0)
+        db[args[1]] = (value, time.monotonic() + int(args[2]))
+        return encode(1)
+    if command == b"TTL":
+        if lookup(db, args[1]) is None:
+            return encode(-2)
+        expires_at = db[args[1]][1]
+        return encode(-1 if expires_at is None else int(expires_at - time.monotonic()))
+    if command == b"DBSIZE":
+        return encode(len(db))
+    if command == b"FLUSHDB":
+        db.clear()
+        return encode("OK")
+    return error(f"unknown command '{command.decode(errors='replace')}'")
+
+
+async def read_command(reader: asyncio.StreamReader) -> list[bytes] | None:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        length = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    state = {"db": 0}
+    try:
+        while True:
+            args = await read_command(reader)
+            if args is None:
+                break
+            if args:
+                writer.write(execute(state, args))
+                await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    server = await asyncio.start_server(handle_client, args.host, args.port)
+    print(f"RESP-заглушка слушает {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
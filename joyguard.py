@@ -1,26 +1,46 @@
 import logging
 import asyncio
+import bisect
+import concurrent.futures
+import contextvars
+import functools
+import hashlib
+import heapq
+import hmac
+import multiprocessing
+import queue
 import sqlite3
 import os
 import html
 import re
+import signal
 import json
 import random
+import threading
 import time
-from collections import deque
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Any
+from pathlib import Path
+from typing import Any, Awaitable, Callable, NamedTuple
+from urllib.parse import urlparse
 
 import aiohttp
+from aiohttp import web
 from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F, methods
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command, CommandStart, ChatMemberUpdatedFilter, IS_NOT_MEMBER, IS_MEMBER, CommandObject
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, StateType, StorageKey
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.enums import ContentType
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -33,15 +53,34 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv("BOT_TOKEN") or ""
 # ID администратора для тех.поддержки
 ADMIN_ID = os.getenv("ADMIN_ID") or ""
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = (os.getenv("BOT_MODE") or "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or ""
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or "/webhook"
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST") or "0.0.0.0"
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or 8080)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or ""
+# Число процессов-воркеров (чаты распределяются между ними по chat_id)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS") or 1)
+# Хранилище общего состояния воркеров (FSM, статус подписки)
+SHARED_STORE_BACKEND = (os.getenv("SHARED_STORE") or "sqlite").lower()
+# Для SHARED_STORE=redis: redis://[:пароль@]хост:порт/номер_бд (подойдёт любой сервер с протоколом RESP)
+REDIS_URL = os.getenv("REDIS_URL") or "redis://127.0.0.1:6379/0"
+# Свой адрес Bot API (локальный сервер или заглушка для нагрузочных тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL") or ""
 
 # Инициализация
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+)
+# FSM-хранилище подключается ниже (fsm_storage), после инициализации БД
+dp = Dispatcher()
 
 # Настройки поведения
 MAX_RANK_ENTRIES = 15
 SWEAR_RANK_ENTRIES = 15
+BLOCKS_PAGE_SIZE = 20
 REQUIRED_CHANNEL = "@silentpower_V"
 REQUIRED_CHANNEL_URL = "https://t.me/silentpower_V"
 WELCOME_TEXT = (
@@ -121,19 +160,27 @@ AI_STYLE_PRESETS = {
         ),
     },
 }
-MEMORY_SUMMARY_PROMPT = (
-    "Ты — тихий наблюдатель, который ведёт внутренний дневник. Получишь одно сообщение и список"
-    " участников. Выдели короткие темы, о чём сейчас идёт разговор, и мысли о том, что человек"
-    " обычно поднимает. Верни строго JSON {\"chat_facts\": [], \"user_facts\": []}, где chat_facts —"
-    " короткие формулировки (до 160 символов) без прямых цитат, а user_facts — массив объектов"
-    " {\"user_id\": int, \"note\": str} с личными заметками о том, какие темы любит этот пользователь."
-    " Нельзя придумывать данные, повторять одно и то же или указывать, что это воспоминания."
+MEMORY_BATCH_PROMPT = (
+    "Ты — тихий наблюдатель, который ведёт внутренний дневник. Получишь пачку сообщений одного чата,"
+    " у каждого есть index, автор и список участников. Выдели короткие темы, о чём идёт разговор, и мысли"
+    " о том, что люди обычно поднимают. Верни строго JSON {\"chat_facts\": [], \"user_facts\": []}, где"
+    " chat_facts — массив объектов {\"source\": int, \"fact\": str} (до 160 символов, без прямых цитат),"
+    " а user_facts — массив объектов {\"source\": int, \"user_id\": int, \"note\": str} с личными заметками"
+    " о том, какие темы любит этот пользователь. source — index сообщения, из которого взят факт, user_id —"
+    " автор или участник именно этого сообщения. Нельзя придумывать данные, повторять одно и то же или"
+    " указывать, что это воспоминания."
 )
 MAX_MEMORY_FACTS = 3
+MEMORY_BATCH_SIZE = 8
+MEMORY_BATCH_MAX_DELAY = 60
+MEMORY_BATCH_CHECK_INTERVAL = 5
 MEMORY_MIN_RECENT_SHARE = 1
 MEMORY_CAPTURE_PROBABILITY = 0.65
 SUBSCRIPTION_CACHE_TTL_OK = 300
 SUBSCRIPTION_CACHE_TTL_FAIL = 30
+# Когда бот — админ канала, статус обновляют события chat_member, а опрос нужен лишь как страховка
+SUBSCRIPTION_EVENT_TTL = 6 * 3600
+SUBSCRIPTION_RECHECK_INTERVAL = 5
 GLOBAL_STYLE_SCOPE = 0
 CUSTOM_STYLE_PROMPT_LIMIT = 600
 CUSTOM_STYLE_MIN_LENGTH = 15
@@ -141,17 +188,39 @@ CUSTOM_STYLE_MIN_WORDS = 4
 
 BOT_ID: int | None = None
 BOT_USERNAME: str | None = None
+subscription_events_enabled = False
 CHAT_HISTORY_LIMIT = 12
 CHAT_HISTORY_CHAR_LIMIT = 1800
 CHAT_MEMORY_DB_LIMIT = 120
-CHAT_MEMORY_CONTEXT_LIMIT = 18
-USER_MEMORY_CONTEXT_LIMIT = 6
+USER_MEMORY_DB_LIMIT = 40
+# Лишние заметки удаляются не после каждой вставки, а когда их накопится столько сверх лимита
+MEMORY_PRUNE_SLACK = 30
+MEMORY_COUNTS_CACHE_SIZE = 20000
+CHAT_MEMORY_CONTEXT_LIMIT = 8
+USER_MEMORY_CONTEXT_LIMIT = 3
+# Поиск заметок: BM25 по тексту сообщения, смешанный со свежестью заметки
+MEMORY_SEARCH_CANDIDATES = 40
+MEMORY_QUERY_TERMS = 12
+# Окончание слова отбрасывается, префикс с * ловит другие формы: "кошки" -> "кош"* находит "кошек"
+MEMORY_QUERY_ENDING_LENGTH = 2
+MEMORY_QUERY_MIN_STEM = 3
+MEMORY_QUERY_STOP_WORDS = frozenset({
+    "что", "чтобы", "кто", "кого", "кому", "чем", "чего", "как", "какой", "какая", "какие", "где", "куда",
+    "когда", "там", "тут", "здесь", "про", "для", "это", "эта", "этот", "эти", "так", "вот", "все", "всё",
+    "уже", "еще", "ещё", "или", "его", "её", "она", "они", "оно", "мне", "меня", "тебе", "тебя", "нас",
+    "вас", "был", "была", "было", "были", "быть", "будет", "есть", "нет", "тоже", "только", "очень",
+    "может", "просто", "через", "потому", "сейчас", "если", "даже", "ну", "да",
+})
+MEMORY_RECENCY_WEIGHT = 0.3
+MEMORY_RECENCY_HALF_LIFE_HOURS = 72
 CHAT_MEMORY_MESSAGE_CHAR_LIMIT = 420
-chat_histories: dict[int, deque[str]] = {}
-subscription_cache: dict[int, tuple[bool, float]] = {}
-ai_style_cache: dict[int, str] = {}
-user_style_cache: dict[int, str | None] = {}
-user_custom_prompt_cache: dict[int, str | None] = {}
+CHAT_HISTORY_CACHE_SIZE = 5000
+CHAT_HISTORY_TTL = 6 * 3600
+SUBSCRIPTION_CACHE_SIZE = 50000
+STYLE_CACHE_SIZE = 50000
+STYLE_CACHE_TTL = 3600
+AUTORESPONDER_CACHE_SIZE = 20000
+AUTORESPONDER_CACHE_TTL = 600
 SWEAR_WORDS = {
     "бля", "блять", "блядь", "бляха", "блят", "бляха-муха", "бляцкий",
     "блядский", "блядство", "блядина", "блядище", "блядун", "бляшка",
@@ -230,8 +299,715 @@ TASK_REJECT_RESPONSES = (
     "Просишь фигню — получаешь посыл. Ступай и делай это без меня."
 )
 
+SQLITE_BUSY_TIMEOUT = 5.0
+SQLITE_STATEMENT_CACHE_SIZE = 256
+SQLITE_CACHE_SIZE_KB = 16384
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024
+DB_READER_THREADS = 4
+STAGE_TIMING_WINDOW = 2000
+STATS_LANE_CONCURRENCY = 8
+STATS_LANE_MAX_PENDING = 2000
+JOB_QUEUE_POLICIES = ("drop_newest", "drop_oldest", "merge")
+MEMORY_JOB_WORKERS = 2
+MEMORY_JOB_QUEUE_SIZE = 200
+MEMORY_JOB_QUEUE_POLICY = "merge"
+AI_LANE_CONCURRENCY = 4
+AI_LANE_MAX_PENDING = 32
+NOTICE_LANE_CONCURRENCY = 32
+UPDATE_CONCURRENCY = 64
+UPDATE_DEDUP_WINDOW = 10000
+SHARD_VIRTUAL_NODES = 160
+SHARD_POLL_TIMEOUT = 10
+SHARD_POLL_BACKOFF_MAX = 30
+SHARD_WORKER_STOP_TIMEOUT = 30
+SHARED_STATE_PURGE_INTERVAL = 600
+REDIS_TIMEOUT = 5
+FSM_STATE_TTL = 24 * 3600
+FSM_CACHE_SIZE = 10000
+FSM_BUFFER_MAX_PENDING = 100
+FSM_FLUSH_INTERVAL = 2
+SEND_LANES = ("critical", "normal", "background")
+SEND_GLOBAL_RATE = 30
+SEND_GLOBAL_BURST = 30
+SEND_CHAT_RATE = 20 / 60
+SEND_CHAT_BURST = 5
+SEND_PRIVATE_CHAT_RATE = 1
+SEND_MAX_RETRIES = 3
+SEND_CHAT_BUCKETS_LIMIT = 10000
+SWEAR_BUFFER_MAX_PENDING = 500
+SWEAR_BUFFER_FLUSH_INTERVAL = 30
+PROFILE_CACHE_SIZE = 50000
+PROFILE_BUFFER_MAX_PENDING = 200
+PROFILE_BUFFER_FLUSH_INTERVAL = 10
+NAME_CACHE_SIZE = 50000
+NAME_CACHE_TTL = 3600
+NAME_MISS_TTL = 300
+NAME_FETCH_CONCURRENCY = 8
+TEMP_MESSAGE_DELAY = 20
+DELETION_RATE_PER_SECOND = 20
+DELETION_BATCH_LIMIT = 100
+DELETE_BATCH_WINDOW = 0.02
+DELETE_BATCH_MAX_SIZE = 100
+DELETION_RETRY_DELAY = 60
+NOTICE_COALESCE_TTL = 15
+NOTICE_COALESCE_EDIT_WINDOW = 3
+
 WORD_PATTERN = re.compile(r"[\wёЁ]+", re.UNICODE)
+# Латиница и цифры, которыми подменяют кириллицу ("cyka", "6лять")
+SWEAR_HOMOGLYPHS = {
+    "a": "а", "c": "с", "e": "е", "o": "о", "p": "р", "x": "х", "y": "у", "k": "к", "m": "м",
+    "ё": "е", "0": "о", "3": "з", "6": "б", "@": "а",
+}
+# Знаки, которые вставляют между буквами ("х.у.й", "б*ять")
+SWEAR_INSERTED_CHARS = ".-*_'`~|"
 AIOHTTP_TIMEOUT = aiohttp.ClientTimeout(total=20)
+OPENROUTER_POOL_LIMIT = 20
+OPENROUTER_DNS_CACHE_TTL = 300
+OPENROUTER_KEEPALIVE_TIMEOUT = 60
+
+
+# ==================== Конвейер обработки ====================
+METRICS_PROVIDERS: dict[str, Callable[[], dict[str, Any]]] = {}
+
+
+def register_metrics(name: str, provider: Callable[[], dict[str, Any]]) -> None:
+    METRICS_PROVIDERS[name] = provider
+
+
+def format_metrics_report() -> str:
+    lines = ["📈 Метрики бота"]
+    for name, provider in METRICS_PROVIDERS.items():
+        try:
+            data = provider()
+        except Exception as exc:
+            data = {"error": str(exc)}
+        lines.append(f"\n[{name}]")
+        for key, value in data.items():
+            lines.append(f"{key}: {value}")
+    return "\n".join(lines)
+
+
+class StageTimings:
+    """Скользящее окно длительностей этапов обработки (для p50/p99)."""
+
+    def __init__(self, window: int = STAGE_TIMING_WINDOW):
+        self.window = window
+        self._samples: dict[str, deque[float]] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        result: dict[str, dict[str, float]] = {}
+        for stage, samples in self._samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            result[stage] = {
+                "count": len(ordered),
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+                "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+            }
+        return result
+
+
+class BackgroundLane:
+    """Фоновая полоса конвейера со своим лимитом параллельности и очереди.
+
+    Сверх max_pending задачи отбрасываются (и считаются), чтобы при медленном
+    внешнем сервисе не копить в памяти задачи с целыми апдейтами; max_pending=None —
+    полоса без потерь для задач, которые нельзя отбрасывать.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_pending: int | None):
+        self.name = name
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def submit(self, job: Callable[[], Awaitable[Any]]) -> bool:
+        if self.max_pending is not None and len(self._tasks) >= self.max_pending:
+            self.dropped += 1
+            logger.debug(f"Полоса '{self.name}' переполнена, задача отброшена")
+            return False
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    def stats(self) -> str:
+        if self.max_pending is None:
+            return f"pending={len(self._tasks)}"
+        return f"pending={len(self._tasks)}/{self.max_pending} dropped={self.dropped}"
+
+    async def _run(self, job: Callable[[], Awaitable[Any]]) -> None:
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                await job()
+            except Exception as exc:
+                logger.warning(f"Фоновая задача '{self.name}' завершилась ошибкой: {exc}")
+            finally:
+                stage_timings.record(self.name, time.perf_counter() - started)
+
+
+class _JobQueue:
+    def __init__(self, name: str, handler: Callable[[Any], Awaitable[Any]], workers: int, maxsize: int,
+                 policy: str, key: Callable[[Any], Any] | None, merge: Callable[[Any, Any], Any] | None):
+        if policy not in JOB_QUEUE_POLICIES:
+            raise ValueError(f"Неизвестная политика очереди: {policy}")
+        if policy == "merge" and (key is None or merge is None):
+            raise ValueError("Политике merge нужны key и merge")
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.policy = policy
+        self.key = key
+        self.merge = merge
+        self.items: deque[tuple[float, Any]] = deque()
+        self.ready = asyncio.Event()
+        self.submitted = 0
+        self.merged = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+
+
+class TaskSupervisor:
+    """Ограниченные очереди фоновых задач: фиксированное число воркеров на тип и политика переполнения.
+
+    Политики: drop_newest — отбросить новую задачу, drop_oldest — вытеснить самую старую,
+    merge — слить с ожидающей задачей с тем же ключом (иначе вытеснить самую старую);
+    merge может вернуть None, если задачи не помещаются в одну, — тогда новая встаёт в очередь отдельно.
+    """
+
+    def __init__(self):
+        self._queues: dict[str, _JobQueue] = {}
+        self._workers: list[asyncio.Task] = []
+
+    def register(self, name: str, handler: Callable[[Any], Awaitable[Any]], *, workers: int, maxsize: int,
+                 policy: str = "drop_oldest", key: Callable[[Any], Any] | None = None,
+                 merge: Callable[[Any, Any], Any] | None = None) -> None:
+        self._queues[name] = _JobQueue(name, handler, workers, maxsize, policy, key, merge)
+
+    def submit(self, name: str, job: Any) -> bool:
+        """Ставит задачу в очередь. Возвращает False, если задача была отброшена."""
+        job_queue = self._queues[name]
+        job_queue.submitted += 1
+        if job_queue.policy == "merge":
+            job_key = job_queue.key(job)
+            for index, (enqueued_at, queued_job) in enumerate(job_queue.items):
+                if job_queue.key(queued_job) != job_key:
+                    continue
+                merged_job = job_queue.merge(queued_job, job)
+                if merged_job is not None:
+                    job_queue.items[index] = (enqueued_at, merged_job)
+                    job_queue.merged += 1
+                    return True
+        if len(job_queue.items) >= job_queue.maxsize:
+            job_queue.dropped += 1
+            if job_queue.policy == "drop_newest":
+                logger.warning(f"Очередь '{name}' переполнена, задача отброшена")
+                return False
+            job_queue.items.popleft()
+            logger.warning(f"Очередь '{name}' переполнена, вытеснена самая старая задача")
+        job_queue.items.append((time.monotonic(), job))
+        job_queue.ready.set()
+        return True
+
+    async def _worker(self, job_queue: _JobQueue) -> None:
+        while True:
+            if not job_queue.items:
+                job_queue.ready.clear()
+                await job_queue.ready.wait()
+                continue
+            enqueued_at, job = job_queue.items.popleft()
+            stage_timings.record(f"{job_queue.name}.wait", time.monotonic() - enqueued_at)
+            started = time.perf_counter()
+            try:
+                await job_queue.handler(job)
+                job_queue.processed += 1
+            except Exception as exc:
+                job_queue.failed += 1
+                logger.warning(f"Задача '{job_queue.name}' завершилась ошибкой: {exc}")
+            finally:
+                stage_timings.record(job_queue.name, time.perf_counter() - started)
+
+    def start(self) -> None:
+        for job_queue in self._queues.values():
+            for _ in range(job_queue.workers):
+                self._workers.append(asyncio.create_task(self._worker(job_queue)))
+
+    async def stop(self) -> dict[str, list[Any]]:
+        """Останавливает воркеров и возвращает задачи, которые не успели выполниться."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        leftovers = {}
+        for name, job_queue in self._queues.items():
+            leftovers[name] = [job for _, job in job_queue.items]
+            job_queue.items.clear()
+        return leftovers
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            name: (
+                f"depth={len(job_queue.items)}/{job_queue.maxsize} submitted={job_queue.submitted} "
+                f"merged={job_queue.merged} dropped={job_queue.dropped} "
+                f"processed={job_queue.processed} failed={job_queue.failed}"
+            )
+            for name, job_queue in self._queues.items()
+        }
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до свободного токена (0 — можно отправлять)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        self.blocked_until = max(self.blocked_until, until)
+
+
+send_lane: contextvars.ContextVar[str] = contextvars.ContextVar("send_lane", default="normal")
+
+
+def send_in_lane(lane: str):
+    """Декоратор: все запросы к Bot API внутри корутины идут через указанную полосу."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = send_lane.set(lane)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                send_lane.reset(token)
+        return wrapper
+    return decorator
+
+
+class _SendRequest:
+    __slots__ = ("lane", "chat_id", "future", "enqueued_at")
+
+    def __init__(self, lane: str, chat_id: int | None, future: asyncio.Future):
+        self.lane = lane
+        self.chat_id = chat_id
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Bot API: общий и початовые token bucket'ы, полосы приоритета.
+
+    Удаления всегда идут в полосу critical и не тратят початовый лимит, остальное — в полосу
+    из send_lane. Початовый лимит касается только отправки и правки сообщений (в личке он мягче,
+    чем в группах). На TelegramRetryAfter
+    чат (или весь бот) ставится на паузу, а запрос возвращается в свою очередь.
+    """
+
+    UNTHROTTLED = (methods.GetUpdates, methods.GetMe, methods.SetWebhook, methods.DeleteWebhook)
+    CHAT_LIMITED_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, global_burst: float = SEND_GLOBAL_BURST,
+                 chat_rate: float = SEND_CHAT_RATE, chat_burst: float = SEND_CHAT_BURST,
+                 private_chat_rate: float = SEND_PRIVATE_CHAT_RATE, max_retries: int = SEND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.private_chat_rate = private_chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats: dict[int, TokenBucket] = {}
+        self._lanes: dict[str, deque[_SendRequest]] = {lane: deque() for lane in SEND_LANES}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.sent = {lane: 0 for lane in SEND_LANES}
+        self.retry_after = 0
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, self.UNTHROTTLED):
+            return await make_request(bot, method)
+        is_delete = isinstance(method, (methods.DeleteMessage, methods.DeleteMessages))
+        lane = "critical" if is_delete else send_lane.get()
+        chat_id = getattr(method, "chat_id", None)
+        if is_delete or not isinstance(chat_id, int) or not type(method).__name__.startswith(self.CHAT_LIMITED_PREFIXES):
+            chat_id = None
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(lane, chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as exc:
+                self.retry_after += 1
+                until = time.monotonic() + exc.retry_after
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).block(until)
+                else:
+                    self._global.block(until)
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Flood limit на {type(method).__name__}, повтор через {exc.retry_after} с")
+
+    async def _acquire(self, lane: str, chat_id: int | None) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        request = _SendRequest(lane, chat_id, asyncio.get_running_loop().create_future())
+        self._lanes[lane].append(request)
+        self._wakeup.set()
+        await request.future
+        stage_timings.record(f"send.{lane}.wait", time.monotonic() - request.enqueued_at)
+        self.sent[lane] += 1
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= SEND_CHAT_BUCKETS_LIMIT:
+                now = time.monotonic()
+                self._chats = {
+                    key: value for key, value in self._chats.items()
+                    if value.delay(now) > 0 or value.tokens < value.capacity
+                }
+            rate = self.chat_rate if chat_id < 0 else self.private_chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _next_ready(self, now: float) -> tuple[_SendRequest | None, float]:
+        """Первый запрос по приоритету, чей чат не упёрся в лимит, и время ожидания иначе."""
+        soonest = float("inf")
+        for lane in SEND_LANES:
+            pending = self._lanes[lane]
+            for request in pending:
+                if request.future.done():
+                    continue
+                if request.chat_id is None:
+                    return request, 0.0
+                wait = self._chat_bucket(request.chat_id).delay(now)
+                if wait == 0:
+                    return request, 0.0
+                soonest = min(soonest, wait)
+        return None, soonest
+
+    async def _dispatch(self) -> None:
+        while True:
+            for pending in self._lanes.values():
+                while pending and pending[0].future.done():
+                    pending.popleft()
+            if not any(self._lanes.values()):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            global_wait = self._global.delay(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+            request, wait = self._next_ready(now)
+            if request is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._lanes[request.lane].remove(request)
+            self._global.take()
+            if request.chat_id is not None:
+                self._chat_bucket(request.chat_id).take()
+            request.future.set_result(None)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict[str, Any]:
+        result: dict[str, Any] = {
+            lane: f"queued={len(self._lanes[lane])} sent={self.sent[lane]}" for lane in SEND_LANES
+        }
+        result["retry_after"] = self.retry_after
+        result["chat_buckets"] = len(self._chats)
+        return result
+
+
+class UpdateDeduplicator(BaseMiddleware):
+    """Пропускает повторно доставленные апдейты (Telegram переотправляет webhook при таймауте)."""
+
+    def __init__(self, window: int = UPDATE_DEDUP_WINDOW):
+        self.window = window
+        self._seen: OrderedDict[int, None] = OrderedDict()
+        self.duplicates = 0
+
+    async def __call__(self, handler, event, data):
+        update_id = event.update_id
+        if update_id in self._seen:
+            self.duplicates += 1
+            logger.debug(f"Повторный апдейт {update_id} пропущен")
+            return None
+        self._seen[update_id] = None
+        if len(self._seen) > self.window:
+            self._seen.popitem(last=False)
+        return await handler(event, data)
+
+    def stats(self) -> dict[str, Any]:
+        return {"remembered": len(self._seen), "duplicates": self.duplicates}
+
+
+class ChatOrderingMiddleware(BaseMiddleware, BaseEventIsolation):
+    """Апдейты разных чатов обрабатываются параллельно (не больше concurrency), одного чата — строго по очереди.
+
+    Порядок внутри чата держит asyncio.Lock (очередь ожидающих FIFO), а задачи апдейтов
+    создаются в порядке получения, поэтому берут замок в том же порядке. Объект служит и
+    изоляцией событий FSM: диспетчер читает состояние уже под замком чата, так что
+    следующий апдейт видит состояние, записанное предыдущим.
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY):
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._locks: dict[int, tuple[asyncio.Lock, list[int]]] = {}
+        self.active = 0
+        self.processed = 0
+
+    async def __call__(self, handler, event, data):
+        if "state" in data:
+            # Замок чата уже взят в lock() при разрешении FSM-контекста
+            return await self._run(handler, event, data)
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        key = chat.id if chat else (user.id if user else None)
+        if key is None:
+            return await self._run(handler, event, data)
+        async with self.chat_lock(key):
+            return await self._run(handler, event, data)
+
+    @asynccontextmanager
+    async def chat_lock(self, key: int):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = (asyncio.Lock(), [0])
+        lock, users = entry
+        users[0] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            users[0] -= 1
+            if not users[0]:
+                self._locks.pop(key, None)
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey):
+        # Ключ FSM (chat_id, а без чата — id пользователя) совпадает с ключом упорядочивания
+        async with self.chat_lock(key.chat_id):
+            yield
+
+    async def close(self) -> None:
+        self._locks.clear()
+
+    async def _run(self, handler, event, data):
+        async with self._semaphore:
+            self.active += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.active -= 1
+                self.processed += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "chats_in_flight": len(self._locks),
+            "processed": self.processed,
+        }
+
+
+_MISSING = object()
+CACHES: list["TTLCache"] = []
+
+
+class TTLCache:
+    """LRU-кэш с ограничением размера и TTL; get_or_load грузит один ключ не более одного раза одновременно.
+
+    ttl может быть функцией от значения (например, разный срок для положительного и
+    отрицательного ответа). set и pop отменяют незавершённую загрузку ключа, чтобы
+    устаревший результат не перезаписал свежую запись.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: float | Callable[[Any], float] | None = None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+        self._inflight: dict[Any, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.loads = 0
+        self.coalesced = 0
+        CACHES.append(self)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Any, default: Any = None) -> Any:
+        """Значение без учёта TTL и без счётчиков — чтобы сравнить новое с прежним."""
+        entry = self._data.get(key)
+        return default if entry is None else entry[0]
+
+    def loading(self, key: Any) -> bool:
+        return key in self._inflight
+
+    def set(self, key: Any, value: Any, ttl: float | None = None) -> None:
+        self._inflight.pop(key, None)
+        self._store(key, value, ttl)
+
+    def _store(self, key: Any, value: Any, ttl: float | None) -> None:
+        if ttl is None:
+            ttl = self.ttl(value) if callable(self.ttl) else self.ttl
+        expires_at = time.monotonic() + ttl if ttl else float("inf")
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Any) -> None:
+        self._inflight.pop(key, None)
+        self._data.pop(key, None)
+
+    async def get_or_load(
+        self,
+        key: Any,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: float | None = None,
+        refresh: bool = False
+    ) -> Any:
+        """refresh=True игнорирует закэшированное значение, но присоединяется к уже идущей загрузке."""
+        if not refresh:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Отменили загрузившую задачу, а не нас — грузим сами
+                return await self.get_or_load(key, loader, ttl, refresh)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.loads += 1
+        try:
+            value = await loader()
+        except BaseException as exc:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            if isinstance(exc, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(exc)
+                future.exception()
+            raise
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+            self._store(key, value, ttl)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = round(self.hits / total, 3) if total else 0.0
+        return (
+            f"size={len(self._data)}/{self.max_size} hit_rate={hit_rate} hits={self.hits} misses={self.misses} "
+            f"loads={self.loads} coalesced={self.coalesced} evictions={self.evictions} expired={self.expirations}"
+        )
+
+
+chat_histories = TTLCache("chat_histories", CHAT_HISTORY_CACHE_SIZE, CHAT_HISTORY_TTL)
+subscription_cache = TTLCache("subscription", SUBSCRIPTION_CACHE_SIZE, lambda subscribed: subscription_ttl(subscribed))
+ai_style_cache = TTLCache("ai_style", 16, STYLE_CACHE_TTL)
+user_style_cache = TTLCache("user_style", STYLE_CACHE_SIZE, STYLE_CACHE_TTL)
+user_custom_prompt_cache = TTLCache("user_custom_prompt", STYLE_CACHE_SIZE, STYLE_CACHE_TTL)
+autoresponder_cache = TTLCache("autoresponder", AUTORESPONDER_CACHE_SIZE, AUTORESPONDER_CACHE_TTL)
+register_metrics("caches", lambda: {cache.name: cache.stats() for cache in CACHES})
+
+
+async def run_periodically(name: str, interval: float, job: Callable[[], Awaitable[Any]]) -> None:
+    """Вызывает job каждые interval секунд, пока задачу не отменят."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception as exc:
+            logger.warning(f"Периодическая задача '{name}' завершилась ошибкой: {exc}")
+
+
+stage_timings = StageTimings()
+stats_lane = BackgroundLane("stats", STATS_LANE_CONCURRENCY, STATS_LANE_MAX_PENDING)
+ai_lane = BackgroundLane("ai", AI_LANE_CONCURRENCY, AI_LANE_MAX_PENDING)
+# Уведомления о блокировках — результат модерации, а не статистика: своя полоса и без отбрасывания
+notice_lane = BackgroundLane("notices", NOTICE_LANE_CONCURRENCY, None)
+register_metrics("stages", stage_timings.snapshot)
+task_supervisor = TaskSupervisor()
+register_metrics("lanes", lambda: {lane.name: lane.stats() for lane in (stats_lane, ai_lane, notice_lane)})
+register_metrics("jobs", lambda: task_supervisor.stats())
+update_deduplicator = UpdateDeduplicator()
+dp.update.outer_middleware(update_deduplicator)
+register_metrics("dedup", update_deduplicator.stats)
+chat_ordering = ChatOrderingMiddleware()
+dp.update.outer_middleware(chat_ordering)
+dp.fsm.events_isolation = chat_ordering
+register_metrics("updates", chat_ordering.stats)
+send_scheduler = SendScheduler()
+bot.session.middleware(send_scheduler)
+register_metrics("send", send_scheduler.stats)
 
 
 def store_chat_history(message: types.Message) -> None:
@@ -244,8 +1020,12 @@ def store_chat_history(message: types.Message) -> None:
         content = f"<{message.content_type}>"
     author = message.from_user.full_name or (f"@{message.from_user.username}" if message.from_user.username else str(message.from_user.id))
     entry = f"{author}: {content}"
-    history = chat_histories.setdefault(message.chat.id, deque(maxlen=CHAT_HISTORY_LIMIT))
+    history = chat_histories.get(message.chat.id)
+    if history is None:
+        history = deque(maxlen=CHAT_HISTORY_LIMIT)
     history.append(entry)
+    # Повторная запись продлевает TTL и поднимает чат в LRU
+    chat_histories.set(message.chat.id, history)
 
 
 def should_capture_memory(message: types.Message) -> bool:
@@ -257,19 +1037,32 @@ def should_capture_memory(message: types.Message) -> bool:
     return random.random() <= MEMORY_CAPTURE_PROBABILITY
 
 
+class MemoryRecord(NamedTuple):
+    """Компактная запись о сообщении для памяти — без ссылки на объект Message."""
+    chat_id: int
+    message_id: int
+    author_id: int | None
+    author_name: str
+    text: str
+    targets: tuple[dict, ...]
+
+
 def schedule_memory_capture(message: types.Message, targets: list[dict]) -> None:
+    if message.chat.type not in {"group", "supergroup"}:
+        return
     if not should_capture_memory(message):
         return
 
-    cloned_targets = [target.copy() for target in targets]
-
-    async def _runner():
-        try:
-            await store_structured_memories(message, cloned_targets)
-        except Exception as exc:
-            logger.warning(f"Memory capture failed: {exc}")
-
-    asyncio.create_task(_runner())
+    memory_batcher.add(
+        MemoryRecord(
+            chat_id=message.chat.id,
+            message_id=message.message_id,
+            author_id=message.from_user.id if message.from_user else None,
+            author_name=get_display_name(message.from_user),
+            text=summarize_message_text(message),
+            targets=tuple(serialize_targets_for_prompt(targets))
+        )
+    )
 
 
 def get_chat_history_entries(chat_id: int) -> list[str]:
@@ -289,18 +1082,17 @@ def get_display_name(user: types.User | None) -> str:
     return f"ID{user.id}"
 
 
-def build_user_memory_context(chat_id: int, targets: list[dict]) -> list[str]:
+async def build_user_memory_context(chat_id: int, targets: list[dict], query: str | None = None) -> list[str]:
     context_lines: list[str] = []
     for target in targets:
         target_id = target.get("user_id")
         if not target_id:
             continue
-        notes = db.get_user_memories(chat_id, target_id, USER_MEMORY_CONTEXT_LIMIT)
+        notes = await adb.search_user_memories(chat_id, target_id, query, USER_MEMORY_CONTEXT_LIMIT)
         if not notes:
             continue
         name = target.get("name") or (f"@{target.get('username')}" if target.get("username") else f"ID{target_id}")
-        sampled_notes = choose_varied_entries(notes, max(1, USER_MEMORY_CONTEXT_LIMIT // 2))
-        for note in sampled_notes:
+        for note in notes:
             context_lines.append(f"{name}: {note}")
     return context_lines
 
@@ -320,6 +1112,78 @@ def serialize_targets_for_prompt(targets: list[dict]) -> list[dict[str, Any]]:
     return serialized
 
 
+class OpenRouterClient:
+    """Общая сессия aiohttp к OpenRouter: пул keep-alive соединений и кэш DNS на всё приложение."""
+
+    def __init__(self):
+        self._session: aiohttp.ClientSession | None = None
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    def _build_trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_connection_create_end(session, context, params):
+            self.connections_created += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.connections_reused += 1
+
+        async def on_dns_cache_hit(session, context, params):
+            self.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(session, context, params):
+            self.dns_cache_misses += 1
+
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=OPENROUTER_POOL_LIMIT,
+                limit_per_host=OPENROUTER_POOL_LIMIT,
+                ttl_dns_cache=OPENROUTER_DNS_CACHE_TTL,
+                keepalive_timeout=OPENROUTER_KEEPALIVE_TIMEOUT,
+                enable_cleanup_closed=True
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=AIOHTTP_TIMEOUT,
+                trace_configs=[self._build_trace_config()]
+            )
+        return self._session
+
+    async def post(self, url: str, **kwargs) -> tuple[int, str]:
+        self.requests += 1
+        async with self.get_session().post(url, **kwargs) as response:
+            return response.status, await response.text()
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "dns_cache_hits": self.dns_cache_hits,
+            "dns_cache_misses": self.dns_cache_misses,
+        }
+
+
+openrouter_client = OpenRouterClient()
+register_metrics("openrouter", openrouter_client.stats)
+
+
 async def call_openrouter(messages: list[dict[str, str]], *, temperature: float = 0.9, max_tokens: int = 400) -> str | None:
     if not OPENROUTER_API_KEY:
         return None
@@ -336,13 +1200,11 @@ async def call_openrouter(messages: list[dict[str, str]], *, temperature: float
         "X-Title": "SpringtrapSilent"
     }
     try:
-        async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
-            async with session.post(OPENROUTER_API_URL, json=payload, headers=headers) as response:
-                response_text = await response.text()
-                if response.status != 200:
-                    logger.error(f"OpenRouter API error {response.status}: {response_text}")
-                    return None
-                data = json.loads(response_text)
+        status, response_text = await openrouter_client.post(OPENROUTER_API_URL, json=payload, headers=headers)
+        if status != 200:
+            logger.error(f"OpenRouter API error {status}: {response_text}")
+            return None
+        data = json.loads(response_text)
     except Exception as exc:
         logger.error(f"OpenRouter request failed: {exc}")
         return None
@@ -371,12 +1233,10 @@ async def generate_ai_reply(
         history_text = "\n".join(f"- {line}" for line in trimmed)
         sections.append(f"Внутренний пересказ беседы (не цитируй это напрямую):\n{history_text}")
     if chat_memories:
-        varied_chat_memories = choose_varied_entries(chat_memories, CHAT_MEMORY_CONTEXT_LIMIT)
-        memories_text = "\n".join(f"- {line}" for line in varied_chat_memories)
+        memories_text = "\n".join(f"- {line}" for line in chat_memories)
         sections.append(f"Мои наблюдения о теме разговора (держи в голове, но не раскрывай):\n{memories_text}")
     if user_memories:
-        varied_user_memories = choose_varied_entries(user_memories, USER_MEMORY_CONTEXT_LIMIT)
-        user_text = "\n".join(f"- {line}" for line in varied_user_memories)
+        user_text = "\n".join(f"- {line}" for line in user_memories)
         sections.append(f"Мои личные заметки о собеседниках (не рассказывай о них):\n{user_text}")
 
     context_block = "\n\n".join(sections) if sections else "Нет дополнительного контекста."
@@ -387,13 +1247,13 @@ async def generate_ai_reply(
         f" Ответь на это сообщение своим обычным язвительным стилем:\n{text}"
     )
     user_id = message.from_user.id if message.from_user else None
-    style_key = get_effective_ai_style(user_id)
+    style_key = await get_effective_ai_style(user_id)
     custom_prompt: str | None = None
     if style_key == CUSTOM_STYLE_KEY:
-        custom_prompt = get_user_custom_prompt(user_id)
+        custom_prompt = await get_user_custom_prompt(user_id)
         if not custom_prompt:
             logger.warning("Пользователь выбрал кастомный стиль, но описание пустое. Возвращаю стиль по умолчанию.")
-            style_key = get_default_ai_style()
+            style_key = await get_default_ai_style()
     style_prompt = custom_prompt or AI_STYLE_PRESETS.get(style_key, AI_STYLE_PRESETS[DEFAULT_AI_STYLE])["prompt"]
     messages = [
         {"role": "system", "content": style_prompt},
@@ -416,161 +1276,294 @@ def normalize_message_text(value: str | None) -> str | None:
     return normalized.lower() if normalized else None
 
 
-def choose_varied_entries(entries: list[str], limit: int) -> list[str]:
-    if limit <= 0 or len(entries) <= limit:
-        return entries
-    recent_keep = entries[:max(MEMORY_MIN_RECENT_SHARE, min(limit // 2, len(entries)))]
-    remaining = entries[len(recent_keep):]
-    to_pick = limit - len(recent_keep)
-    if remaining and to_pick > 0:
-        sampled = random.sample(remaining, min(to_pick, len(remaining)))
-        recent_keep += sampled
-    return recent_keep
+def build_memory_query(text: str | None) -> str | None:
+    """FTS5-запрос из значимых слов сообщения; отрезанное окончание грубо заменяет стемминг."""
+    if not text:
+        return None
+    terms = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if len(word) < MEMORY_QUERY_MIN_STEM or word.isdigit() or word in MEMORY_QUERY_STOP_WORDS:
+            continue
+        stem = word[:max(MEMORY_QUERY_MIN_STEM, len(word) - MEMORY_QUERY_ENDING_LENGTH)]
+        term = f'"{stem}"*'
+        if term not in terms:
+            terms.append(term)
+        if len(terms) >= MEMORY_QUERY_TERMS:
+            break
+    return " OR ".join(terms) or None
 
 
-async def extract_memory_facts(message: types.Message, targets: list[dict]) -> tuple[list[str], dict[int, list[str]]]:
-    text = message.text or message.caption
-    if not text or not OPENROUTER_API_KEY:
-        return [], {}
+async def extract_memory_facts(
+    records: list[MemoryRecord]
+) -> tuple[list[tuple[int, str]], list[tuple[int, int, str]]]:
+    """Один запрос к LLM на пачку сообщений. Факты возвращаются с индексом исходного сообщения."""
+    if not records or not OPENROUTER_API_KEY:
+        return [], []
 
-    target_payload = serialize_targets_for_prompt(targets)
     payload = {
         "role": "user",
         "content": json.dumps(
             {
-                "chat_id": message.chat.id,
-                "author_id": message.from_user.id if message.from_user else None,
-                "author_name": get_display_name(message.from_user),
-                "text": text,
-                "targets": target_payload
+                "chat_id": records[0].chat_id,
+                "messages": [
+                    {
+                        "index": index,
+                        "author_id": record.author_id,
+                        "author_name": record.author_name,
+                        "text": record.text,
+                        "targets": list(record.targets)
+                    }
+                    for index, record in enumerate(records)
+                ]
             },
             ensure_ascii=False
         )
     }
     response = await call_openrouter(
         [
-            {"role": "system", "content": MEMORY_SUMMARY_PROMPT},
+            {"role": "system", "content": MEMORY_BATCH_PROMPT},
             payload
         ],
         temperature=0.2,
-        max_tokens=300
+        max_tokens=150 + 120 * len(records)
     )
     if not response:
-        return [], {}
+        return [], []
     try:
-        parsed = json.loads(response)
+        parsed = json.loads(response.strip().removeprefix("```json").strip("`").strip())
     except json.JSONDecodeError:
-        return [], {}
-
-    chat_facts = []
-    if isinstance(parsed, dict):
-        for fact in (parsed.get("chat_facts") or [])[:MAX_MEMORY_FACTS]:
-            if isinstance(fact, str) and fact.strip():
-                chat_facts.append(fact.strip())
-    user_facts: dict[int, list[str]] = {}
+        return [], []
+    if not isinstance(parsed, dict):
+        return [], []
+
+    def source_index(entry: dict) -> int | None:
+        index = entry.get("source")
+        if isinstance(index, int) and 0 <= index < len(records):
+            return index
+        return None
+
+    chat_facts: list[tuple[int, str]] = []
+    facts_per_source: dict[int, int] = {}
+    for entry in parsed.get("chat_facts") or []:
+        if not isinstance(entry, dict):
+            continue
+        index = source_index(entry)
+        fact = entry.get("fact")
+        if index is None or not isinstance(fact, str) or not fact.strip():
+            continue
+        if facts_per_source.get(index, 0) >= MAX_MEMORY_FACTS:
+            continue
+        facts_per_source[index] = facts_per_source.get(index, 0) + 1
+        chat_facts.append((index, fact.strip()))
+
+    user_facts: list[tuple[int, int, str]] = []
+    notes_per_subject: dict[tuple[int, int], int] = {}
     for entry in parsed.get("user_facts") or []:
         if not isinstance(entry, dict):
             continue
+        index = source_index(entry)
         uid = entry.get("user_id")
         note = entry.get("note")
-        if isinstance(uid, int) and isinstance(note, str) and note.strip():
-            user_facts.setdefault(uid, []).append(note.strip())
+        if index is None or not isinstance(uid, int) or not isinstance(note, str) or not note.strip():
+            continue
+        record = records[index]
+        participants = {record.author_id} | {target.get("user_id") for target in record.targets}
+        if uid not in participants:
+            continue
+        key = (index, uid)
+        if notes_per_subject.get(key, 0) >= MAX_MEMORY_FACTS:
+            continue
+        notes_per_subject[key] = notes_per_subject.get(key, 0) + 1
+        user_facts.append((index, uid, note.strip()))
     return chat_facts, user_facts
 
 
-def get_default_ai_style() -> str:
-    style = ai_style_cache.get(GLOBAL_STYLE_SCOPE)
-    if style in AI_STYLE_PRESETS:
-        return style
-    stored = db.get_chat_setting(GLOBAL_STYLE_SCOPE, "ai_style")
-    if stored in AI_STYLE_PRESETS:
-        ai_style_cache[GLOBAL_STYLE_SCOPE] = stored
-        return stored
-    ai_style_cache[GLOBAL_STYLE_SCOPE] = DEFAULT_AI_STYLE
-    return DEFAULT_AI_STYLE
+async def get_default_ai_style() -> str:
+    async def load() -> str:
+        stored = await adb.get_chat_setting(GLOBAL_STYLE_SCOPE, "ai_style")
+        return stored if stored in AI_STYLE_PRESETS else DEFAULT_AI_STYLE
+
+    return await ai_style_cache.get_or_load(GLOBAL_STYLE_SCOPE, load)
 
 
-def set_default_ai_style(style_key: str) -> None:
-    ai_style_cache[GLOBAL_STYLE_SCOPE] = style_key
-    db.set_chat_setting(GLOBAL_STYLE_SCOPE, "ai_style", style_key)
+async def set_default_ai_style(style_key: str) -> None:
+    ai_style_cache.set(GLOBAL_STYLE_SCOPE, style_key)
+    await adb.set_chat_setting(GLOBAL_STYLE_SCOPE, "ai_style", style_key)
+    invalidation_bus.publish("ai_style", GLOBAL_STYLE_SCOPE)
 
 
-def get_user_style(user_id: int | None) -> str | None:
+async def get_user_style(user_id: int | None) -> str | None:
     if not user_id:
         return None
-    cached = user_style_cache.get(user_id)
-    if cached in AI_STYLE_PRESETS or cached == CUSTOM_STYLE_KEY:
-        return cached
-    stored = db.get_user_setting(user_id, "ai_style")
-    if stored in AI_STYLE_PRESETS or stored == CUSTOM_STYLE_KEY:
-        user_style_cache[user_id] = stored
-        return stored
-    user_style_cache[user_id] = None
-    return None
+
+    async def load() -> str | None:
+        stored = await adb.get_user_setting(user_id, "ai_style")
+        if stored in AI_STYLE_PRESETS or stored == CUSTOM_STYLE_KEY:
+            return stored
+        return None
+
+    return await user_style_cache.get_or_load(user_id, load)
 
 
-def set_user_style(user_id: int, style_key: str) -> None:
-    user_style_cache[user_id] = style_key
-    db.set_user_setting(user_id, "ai_style", style_key)
+async def set_user_style(user_id: int, style_key: str) -> None:
+    user_style_cache.set(user_id, style_key)
+    await adb.set_user_setting(user_id, "ai_style", style_key)
+    invalidation_bus.publish("user_style", user_id)
 
 
-def reset_user_style(user_id: int) -> None:
-    user_style_cache[user_id] = None
-    user_custom_prompt_cache[user_id] = None
-    db.delete_user_setting(user_id, "ai_style")
-    db.delete_user_setting(user_id, "ai_style_custom_prompt")
+async def reset_user_style(user_id: int) -> None:
+    user_style_cache.set(user_id, None)
+    user_custom_prompt_cache.set(user_id, None)
+    await adb.delete_user_setting(user_id, "ai_style")
+    await adb.delete_user_setting(user_id, "ai_style_custom_prompt")
+    invalidation_bus.publish("user_style", user_id)
 
 
-def get_effective_ai_style(user_id: int | None) -> str:
-    personal = get_user_style(user_id)
+async def get_effective_ai_style(user_id: int | None) -> str:
+    personal = await get_user_style(user_id)
     if personal == CUSTOM_STYLE_KEY:
         return CUSTOM_STYLE_KEY
     if personal in AI_STYLE_PRESETS:
         return personal
-    return get_default_ai_style()
+    return await get_default_ai_style()
 
 
-def get_user_custom_prompt(user_id: int | None) -> str | None:
+async def get_user_custom_prompt(user_id: int | None) -> str | None:
     if not user_id:
         return None
-    if user_id in user_custom_prompt_cache:
-        return user_custom_prompt_cache[user_id]
-    value = db.get_user_setting(user_id, "ai_style_custom_prompt")
-    user_custom_prompt_cache[user_id] = value
-    return value
+    return await user_custom_prompt_cache.get_or_load(
+        user_id, lambda: adb.get_user_setting(user_id, "ai_style_custom_prompt")
+    )
 
 
-def set_user_custom_prompt(user_id: int, prompt: str) -> None:
+async def set_user_custom_prompt(user_id: int, prompt: str) -> None:
     cleaned = prompt.strip()
     trimmed = cleaned[:CUSTOM_STYLE_PROMPT_LIMIT]
-    user_custom_prompt_cache[user_id] = trimmed
-    db.set_user_setting(user_id, "ai_style_custom_prompt", trimmed)
+    user_custom_prompt_cache.set(user_id, trimmed)
+    await adb.set_user_setting(user_id, "ai_style_custom_prompt", trimmed)
+    invalidation_bus.publish("user_style", user_id)
 
 
-async def store_structured_memories(message: types.Message, targets: list[dict]):
-    if message.chat.type not in {"group", "supergroup"}:
-        return
-    summary = summarize_message_text(message)
-    author_id = message.from_user.id if message.from_user else None
-    author_name = get_display_name(message.from_user)
-    db.add_chat_memory(message.chat.id, message.message_id, author_id, author_name, summary)
+async def get_global_autoresponder(user_id: int) -> str | None:
+    return await autoresponder_cache.get_or_load(user_id, lambda: adb.get_global_autoresponder(user_id))
+
 
-    chat_facts, user_facts = await extract_memory_facts(message, targets)
-    for fact in chat_facts:
-        db.add_chat_memory(message.chat.id, None, author_id, author_name, fact)
+async def set_global_autoresponder(user_id: int, text: str) -> None:
+    await adb.set_global_autoresponder(user_id, text)
+    autoresponder_cache.set(user_id, text)
+    invalidation_bus.publish("autoresponder", user_id)
 
-    for subject_id, notes in user_facts.items():
-        for note in notes[:MAX_MEMORY_FACTS]:
-            db.add_user_memory(message.chat.id, subject_id, author_id, note)
 
-    if not chat_facts and not user_facts and targets and (message.text or message.caption):
-        for target in targets:
+async def store_structured_memories(records: list[MemoryRecord], *, extract: bool = True):
+    """Сохраняет пачку сообщений одного чата и извлечённые из неё факты одной транзакцией."""
+    if not records:
+        return
+    chat_id = records[0].chat_id
+    chat_rows = [
+        (chat_id, record.message_id, record.author_id, record.author_name, record.text)
+        for record in records
+    ]
+    user_rows = []
+
+    if extract:
+        chat_facts, user_facts = await extract_memory_facts(records)
+    else:
+        chat_facts, user_facts = [], []
+    for index, fact in chat_facts:
+        record = records[index]
+        chat_rows.append((chat_id, None, record.author_id, record.author_name, fact))
+    for index, subject_id, note in user_facts:
+        user_rows.append((chat_id, subject_id, records[index].author_id, note))
+
+    sources_with_facts = {index for index, _ in chat_facts} | {index for index, _, _ in user_facts}
+    for index, record in enumerate(records):
+        if index in sources_with_facts or not record.targets:
+            continue
+        for target in record.targets:
             target_id = target.get("user_id")
             if not target_id:
                 continue
             target_name = target.get("name") or (f"@{target.get('username')}" if target.get("username") else "этот пользователь")
-            note = f"{author_name} обычно заводит тему '{summary}' когда общается с {target_name}"
-            db.add_user_memory(message.chat.id, target_id, author_id, note)
+            note = f"{record.author_name} обычно заводит тему '{record.text}' когда общается с {target_name}"
+            user_rows.append((chat_id, target_id, record.author_id, note))
+
+    await adb.add_memories_batch(chat_rows, user_rows)
+
+
+class MemoryCaptureBatcher:
+    """Копит сообщения по чатам и отдаёт пачку на извлечение фактов по размеру или по времени."""
+
+    def __init__(self, batch_size: int = MEMORY_BATCH_SIZE, max_delay: float = MEMORY_BATCH_MAX_DELAY):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._batches: dict[int, list[MemoryRecord]] = {}
+        self._opened_at: dict[int, float] = {}
+        self.captured = 0
+        self.batches_sent = 0
+
+    def add(self, record: MemoryRecord) -> None:
+        batch = self._batches.get(record.chat_id)
+        if batch is None:
+            batch = self._batches[record.chat_id] = []
+            self._opened_at[record.chat_id] = time.monotonic()
+        batch.append(record)
+        self.captured += 1
+        if len(batch) >= self.batch_size:
+            self._dispatch(record.chat_id)
+
+    def _take(self, chat_id: int) -> list[MemoryRecord]:
+        self._opened_at.pop(chat_id, None)
+        return self._batches.pop(chat_id, [])
+
+    def _dispatch(self, chat_id: int) -> None:
+        records = self._take(chat_id)
+        if not records:
+            return
+        self.batches_sent += 1
+        task_supervisor.submit("memory", records)
+
+    async def flush_due(self) -> None:
+        deadline = time.monotonic() - self.max_delay
+        for chat_id in [chat_id for chat_id, opened in self._opened_at.items() if opened <= deadline]:
+            self._dispatch(chat_id)
+
+    async def flush_all(self) -> None:
+        """При остановке сохраняет накопленные сообщения без запроса к LLM."""
+        for chat_id in list(self._batches):
+            records = self._take(chat_id)
+            try:
+                await store_structured_memories(records, extract=False)
+            except Exception as exc:
+                logger.error(f"Не удалось сохранить память чата {chat_id} при остановке: {exc}")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "open_batches": len(self._batches),
+            "buffered": sum(len(batch) for batch in self._batches.values()),
+            "captured": self.captured,
+            "batches_sent": self.batches_sent,
+        }
+
+
+def merge_memory_batches(queued: list[MemoryRecord], new: list[MemoryRecord]) -> list[MemoryRecord] | None:
+    """Склеивает пачки одного чата, пока они укладываются в MEMORY_BATCH_SIZE сообщений:
+    размер промпта и max_tokens извлечения растут с пачкой, поэтому большая пачка встаёт в очередь отдельно."""
+    if len(queued) + len(new) > MEMORY_BATCH_SIZE:
+        return None
+    return queued + new
+
+
+memory_batcher = MemoryCaptureBatcher()
+register_metrics("memory_batcher", memory_batcher.stats)
+task_supervisor.register(
+    "memory",
+    store_structured_memories,
+    workers=MEMORY_JOB_WORKERS,
+    maxsize=MEMORY_JOB_QUEUE_SIZE,
+    policy=MEMORY_JOB_QUEUE_POLICY,
+    key=lambda records: records[0].chat_id,
+    merge=merge_memory_batches
+)
 
 
 def is_echo_of_bot_message(message: types.Message) -> bool:
@@ -634,14 +1627,160 @@ def message_mentions_bot(message: types.Message) -> bool:
     return text_has_tag(message.text, message.entities) or text_has_tag(message.caption, message.caption_entities)
 
 # ==================== База данных ====================
+class BlockIndex:
+    """Индекс блокировок в памяти: проверка ответа без обращений к SQLite.
+
+    Изменяется только через методы Database (write-through), читается из обработчиков.
+    """
+
+    def __init__(self):
+        self._blocks: dict[int, dict[tuple[int, int], str | None]] = {}
+        self._global_blocks: dict[int, dict[int, str | None]] = {}
+        self._exceptions: dict[int, set[tuple[int, int]]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, blocks, global_blocks, exceptions):
+        """Полностью пересобирает индекс из строк таблиц."""
+        new_blocks: dict[int, dict[tuple[int, int], str | None]] = {}
+        for chat_id, blocker_id, blocked_id, personal_message in blocks:
+            new_blocks.setdefault(chat_id, {})[(blocker_id, blocked_id)] = personal_message
+        new_global: dict[int, dict[int, str | None]] = {}
+        for chat_id, blocker_id, message in global_blocks:
+            new_global.setdefault(chat_id, {})[blocker_id] = message
+        new_exceptions: dict[int, set[tuple[int, int]]] = {}
+        for chat_id, blocker_id, allowed_id in exceptions:
+            new_exceptions.setdefault(chat_id, set()).add((blocker_id, allowed_id))
+        with self._lock:
+            self._blocks = new_blocks
+            self._global_blocks = new_global
+            self._exceptions = new_exceptions
+
+    def has_blockers(self, chat_id: int) -> bool:
+        """Есть ли в чате хоть одна блокировка (обычная или 'Спринг стоп все')."""
+        return chat_id in self._blocks or chat_id in self._global_blocks
+
+    def get_global_block(self, chat_id: int, blocker_id: int) -> tuple[bool, str | None]:
+        chat_global = self._global_blocks.get(chat_id)
+        if not chat_global or blocker_id not in chat_global:
+            return False, None
+        return True, chat_global[blocker_id]
+
+    def find_block(self, chat_id: int, blocker_id: int, replier_id: int) -> tuple[bool, str | None]:
+        """Запрещено ли replier_id отвечать blocker_id и какой текст показать."""
+        enabled, message = self.get_global_block(chat_id, blocker_id)
+        if enabled and (blocker_id, replier_id) not in self._exceptions.get(chat_id, ()):
+            return True, message
+        chat_blocks = self._blocks.get(chat_id)
+        if chat_blocks:
+            key = (blocker_id, replier_id)
+            if key in chat_blocks:
+                return True, chat_blocks[key]
+        return False, None
+
+    def set_block(self, chat_id: int, blocker_id: int, blocked_id: int, personal_message: str | None, enabled: bool):
+        with self._lock:
+            if enabled:
+                self._blocks.setdefault(chat_id, {})[(blocker_id, blocked_id)] = personal_message
+                return
+            chat_blocks = self._blocks.get(chat_id)
+            if chat_blocks is None:
+                return
+            chat_blocks.pop((blocker_id, blocked_id), None)
+            if not chat_blocks:
+                del self._blocks[chat_id]
+
+    def set_global_block(self, chat_id: int, blocker_id: int, message: str | None, enabled: bool):
+        with self._lock:
+            if enabled:
+                self._global_blocks.setdefault(chat_id, {})[blocker_id] = message
+                # Новое включение сбрасывает старые исключения, как и в БД
+                chat_exceptions = self._exceptions.get(chat_id)
+                if chat_exceptions:
+                    chat_exceptions.difference_update({pair for pair in chat_exceptions if pair[0] == blocker_id})
+                    if not chat_exceptions:
+                        del self._exceptions[chat_id]
+                return
+            chat_global = self._global_blocks.get(chat_id)
+            if chat_global is None:
+                return
+            chat_global.pop(blocker_id, None)
+            if not chat_global:
+                del self._global_blocks[chat_id]
+
+    def set_exception(self, chat_id: int, blocker_id: int, allowed_id: int, allowed: bool):
+        with self._lock:
+            if allowed:
+                self._exceptions.setdefault(chat_id, set()).add((blocker_id, allowed_id))
+                return
+            chat_exceptions = self._exceptions.get(chat_id)
+            if chat_exceptions is None:
+                return
+            chat_exceptions.discard((blocker_id, allowed_id))
+            if not chat_exceptions:
+                del self._exceptions[chat_id]
+
+
 class Database:
     def __init__(self, db_name="joyguard.db"):
         self.db_name = db_name
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # Число заметок по ключу хранения; меняется только в потоке записи
+        self._memory_counts: OrderedDict[tuple, int] = OrderedDict()
+        self.memory_prunes = 0
+        self.memory_fts = False
+        self.block_index = BlockIndex()
         self.init_db()
-    
+        self.load_block_index()
+
+    def _open_connection(self, readonly: bool = False) -> sqlite3.Connection:
+        """Открывает соединение и применяет PRAGMA для долгой работы."""
+        if readonly:
+            target = f"{Path(self.db_name).resolve().as_uri()}?mode=ro"
+        else:
+            target = self.db_name
+        conn = sqlite3.connect(
+            target,
+            timeout=SQLITE_BUSY_TIMEOUT,
+            cached_statements=SQLITE_STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
+            uri=readonly
+        )
+        if not readonly:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
     def get_connection(self):
-        return sqlite3.connect(self.db_name)
-    
+        """Возвращает долгоживущее соединение текущего потока."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open_connection()
+            self._local.conn = conn
+        return conn
+
+    def open_reader(self):
+        """Привязывает к текущему потоку соединение только для чтения."""
+        self._local.conn = self._open_connection(readonly=True)
+
+    def close(self):
+        """Закрывает все открытые соединения."""
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as exc:
+                logger.debug(f"Не удалось закрыть соединение с БД: {exc}")
+        self._local = threading.local()
+
     def init_db(self):
         """Инициализация базы данных"""
         conn = self.get_connection()
@@ -804,8 +1943,122 @@ class Database:
             )
         ''')
 
+        # Общее состояние воркеров: FSM, статус подписки (ключ-значение с TTL)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shared_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            )
+        ''')
+
+        # Отложенные удаления временных уведомлений (переживают перезапуск)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled_deletions (
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                due_at REAL NOT NULL,
+                PRIMARY KEY (chat_id, message_id)
+            )
+        ''')
+
+        # Счётчики блокировок по чату: сколько выдал (issued) и сколько получил (received)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS block_counts (
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                issued INTEGER NOT NULL DEFAULT 0,
+                received INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (chat_id, user_id)
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_block_counts_issued ON block_counts (chat_id, issued DESC, user_id)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_block_counts_received ON block_counts (chat_id, received DESC, user_id)"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_blocks_blocked ON blocks (chat_id, blocked_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_memories_chat ON chat_memories (chat_id, id)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_user_memories_subject ON user_memories (chat_id, subject_user_id, id)"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_blocks_blocker ON blocks (chat_id, blocker_id, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_swear_stats_rank ON swear_stats (chat_id, count DESC, user_id)")
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM block_counts), EXISTS(SELECT 1 FROM blocks)")
+        has_counts, has_blocks = cursor.fetchone()
+        if has_blocks and not has_counts:
+            self.rebuild_block_counts(cursor)
+
         conn.commit()
-        conn.close()
+        self.memory_fts = self.init_memory_search(conn)
+
+    # Полнотекстовые индексы заметок: scope — служебный токен чата/собеседника для фильтра в MATCH
+    MEMORY_FTS_TABLES = (
+        ("chat_memories", "summary", "'c' || replace(chat_id, '-', 'n')"),
+        ("user_memories", "note", "'c' || replace(chat_id, '-', 'n') || 's' || subject_user_id"),
+    )
+
+    def init_memory_search(self, conn: sqlite3.Connection) -> bool:
+        """Создаёт FTS5-индексы заметок с триггерами; без FTS5 в сборке SQLite поиск идёт по свежести."""
+        try:
+            with conn:
+                for table, column, scope in self.MEMORY_FTS_TABLES:
+                    exists = conn.execute(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table}_fts",)
+                    ).fetchone()
+                    conn.execute(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5("
+                        f"{column}, scope, tokenize = 'unicode61 remove_diacritics 2')"
+                    )
+                    new_scope = scope.replace("chat_id", "new.chat_id").replace("subject_user_id", "new.subject_user_id")
+                    conn.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                            INSERT INTO {table}_fts (rowid, {column}, scope) VALUES (new.id, new.{column}, {new_scope});
+                        END
+                    """)
+                    conn.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                            DELETE FROM {table}_fts WHERE rowid = old.id;
+                        END
+                    """)
+                    if not exists:
+                        conn.execute(
+                            f"INSERT INTO {table}_fts (rowid, {column}, scope) SELECT id, {column}, {scope} FROM {table}"
+                        )
+        except sqlite3.OperationalError as exc:
+            logger.warning(f"FTS5 недоступен, заметки подбираются по свежести: {exc}")
+            return False
+        return True
+
+    @staticmethod
+    def rebuild_block_counts(cursor: sqlite3.Cursor) -> None:
+        """Пересчитывает block_counts из blocks (первый запуск после обновления)."""
+        cursor.execute("DELETE FROM block_counts")
+        cursor.execute('''
+            INSERT INTO block_counts (chat_id, user_id, issued, received)
+            SELECT chat_id, user_id, SUM(issued), SUM(received) FROM (
+                SELECT chat_id, blocker_id AS user_id, 1 AS issued, 0 AS received FROM blocks
+                UNION ALL
+                SELECT chat_id, blocked_id AS user_id, 0 AS issued, 1 AS received FROM blocks
+            )
+            GROUP BY chat_id, user_id
+        ''')
+        logger.info(f"Счётчики блокировок пересчитаны: {cursor.rowcount} строк")
+
+    def load_block_index(self):
+        """Загружает blocks, global_blocks и исключения в BlockIndex."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT chat_id, blocker_id, blocked_id, personal_message FROM blocks")
+        blocks = cursor.fetchall()
+        cursor.execute("SELECT chat_id, blocker_id, message FROM global_blocks")
+        global_blocks = cursor.fetchall()
+        cursor.execute("SELECT chat_id, blocker_id, allowed_id FROM global_block_exceptions")
+        exceptions = cursor.fetchall()
+        self.block_index.load(blocks, global_blocks, exceptions)
+        logger.info(
+            f"Индекс блокировок загружен: {len(blocks)} блокировок, "
+            f"{len(global_blocks)} режимов 'стоп все', {len(exceptions)} исключений"
+        )
 
     def get_chat_setting(self, chat_id: int, key: str) -> str | None:
         conn = self.get_connection()
@@ -815,7 +2068,6 @@ class Database:
             (chat_id, key)
         )
         row = cursor.fetchone()
-        conn.close()
         return row[0] if row else None
 
     def set_chat_setting(self, chat_id: int, key: str, value: str) -> None:
@@ -832,7 +2084,6 @@ class Database:
             (chat_id, key, value)
         )
         conn.commit()
-        conn.close()
 
     def get_user_setting(self, user_id: int, key: str) -> str | None:
         conn = self.get_connection()
@@ -842,7 +2093,6 @@ class Database:
             (user_id, key)
         )
         row = cursor.fetchone()
-        conn.close()
         return row[0] if row else None
 
     def set_user_setting(self, user_id: int, key: str, value: str) -> None:
@@ -859,7 +2109,6 @@ class Database:
             (user_id, key, value)
         )
         conn.commit()
-        conn.close()
 
     def delete_user_setting(self, user_id: int, key: str) -> None:
         conn = self.get_connection()
@@ -869,75 +2118,127 @@ class Database:
             (user_id, key)
         )
         conn.commit()
-        conn.close()
 
     def add_chat_memory(self, chat_id: int, message_id: int | None, author_id: int | None,
                          author_name: str | None, summary: str) -> None:
-        if not summary:
+        self.add_memories_batch([(chat_id, message_id, author_id, author_name, summary)], [])
+
+    def add_memories_batch(self, chat_rows: list[tuple], user_rows: list[tuple]) -> None:
+        """Вставляет заметки чата (chat_id, message_id, author_id, author_name, summary)
+        и заметки о пользователях (chat_id, subject_user_id, source_user_id, note) одной транзакцией."""
+        chat_rows = [
+            (chat_id, message_id, author_id, author_name, summary[:CHAT_MEMORY_MESSAGE_CHAR_LIMIT])
+            for chat_id, message_id, author_id, author_name, summary in chat_rows
+            if summary
+        ]
+        user_rows = [
+            (chat_id, subject_user_id, source_user_id, note[:CHAT_MEMORY_MESSAGE_CHAR_LIMIT])
+            for chat_id, subject_user_id, source_user_id, note in user_rows
+            if note
+        ]
+        if not chat_rows and not user_rows:
             return
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO chat_memories (chat_id, message_id, author_id, author_name, summary)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (chat_id, message_id, author_id, author_name, summary[:CHAT_MEMORY_MESSAGE_CHAR_LIMIT])
-        )
-        cursor.execute(
-            """
-            DELETE FROM chat_memories
-            WHERE id NOT IN (
-                SELECT id FROM chat_memories WHERE chat_id = ? ORDER BY id DESC LIMIT ?
-            ) AND chat_id = ?
-            """,
-            (chat_id, CHAT_MEMORY_DB_LIMIT, chat_id)
-        )
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO chat_memories (chat_id, message_id, author_id, author_name, summary)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                chat_rows
+            )
+            conn.executemany(
+                """
+                INSERT INTO user_memories (chat_id, subject_user_id, source_user_id, note)
+                VALUES (?, ?, ?, ?)
+                """,
+                user_rows
+            )
+            for chat_id, added in Counter(row[0] for row in chat_rows).items():
+                self._retain_memories(conn, "chat_memories", ("chat_id",), (chat_id,), added, CHAT_MEMORY_DB_LIMIT)
+            for key, added in Counter(row[:2] for row in user_rows).items():
+                self._retain_memories(
+                    conn, "user_memories", ("chat_id", "subject_user_id"), key, added, USER_MEMORY_DB_LIMIT
+                )
 
-    def get_chat_memories(self, chat_id: int, limit: int) -> list[str]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT summary FROM chat_memories WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
-            (chat_id, limit)
-        )
-        rows = cursor.fetchall()
-        conn.close()
-        return [row[0] for row in rows]
+    def _retain_memories(self, conn: sqlite3.Connection, table: str, key_columns: tuple[str, ...],
+                         key: tuple, added: int, limit: int) -> None:
+        """Держит не больше limit+MEMORY_PRUNE_SLACK заметок на ключ; лишнее удаляется диапазоном по индексу."""
+        counter_key = (table, *key)
+        where = " AND ".join(f"{column} = ?" for column in key_columns)
+        count = self._memory_counts.pop(counter_key, None)
+        if count is None:
+            count = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", key).fetchone()[0]
+        else:
+            count += added
+        if count > limit + MEMORY_PRUNE_SLACK:
+            row = conn.execute(
+                f"SELECT id FROM {table} WHERE {where} ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (*key, limit - 1)
+            ).fetchone()
+            if row:
+                conn.execute(f"DELETE FROM {table} WHERE {where} AND id < ?", (*key, row[0]))
+                self.memory_prunes += 1
+            count = limit
+        self._memory_counts[counter_key] = count
+        while len(self._memory_counts) > MEMORY_COUNTS_CACHE_SIZE:
+            self._memory_counts.popitem(last=False)
 
     def add_user_memory(self, chat_id: int, subject_user_id: int, source_user_id: int | None,
                         note: str) -> None:
-        if not note:
-            return
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO user_memories (chat_id, subject_user_id, source_user_id, note)
-            VALUES (?, ?, ?, ?)
-            """,
-            (chat_id, subject_user_id, source_user_id, note[:CHAT_MEMORY_MESSAGE_CHAR_LIMIT])
+        self.add_memories_batch([], [(chat_id, subject_user_id, source_user_id, note)])
+
+    def search_chat_memories(self, chat_id: int, query: str | None, limit: int) -> list[str]:
+        return self._search_memories(
+            "chat_memories", "summary", f"c{chat_id}".replace("-", "n"), "chat_id = ?", (chat_id,), query, limit
         )
-        conn.commit()
-        conn.close()
 
-    def get_user_memories(self, chat_id: int, user_id: int, limit: int) -> list[str]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT note FROM user_memories
-            WHERE chat_id = ? AND subject_user_id = ?
-            ORDER BY id DESC LIMIT ?
-            """,
-            (chat_id, user_id, limit)
+    def search_user_memories(self, chat_id: int, user_id: int, query: str | None, limit: int) -> list[str]:
+        return self._search_memories(
+            "user_memories", "note", f"c{chat_id}s{user_id}".replace("-", "n"),
+            "chat_id = ? AND subject_user_id = ?", (chat_id, user_id), query, limit
         )
-        rows = cursor.fetchall()
-        conn.close()
-        return [row[0] for row in rows]
-    
+
+    def _search_memories(self, table: str, column: str, scope: str, where: str, key: tuple,
+                         query: str | None, limit: int) -> list[str]:
+        """Лучшие заметки по BM25 и свежести; самые новые MEMORY_MIN_RECENT_SHARE попадают всегда."""
+        conn = self.get_connection()
+        age = "(julianday('now') - julianday(created_at)) * 24"
+        candidates: dict[int, tuple[str, float, float]] = {}
+        recent = conn.execute(
+            f"SELECT id, {column}, {age} FROM {table} WHERE {where} ORDER BY id DESC LIMIT ?",
+            (*key, limit)
+        ).fetchall()
+        for row_id, text, age_hours in recent:
+            candidates[row_id] = (text, 0.0, age_hours or 0.0)
+
+        if query and self.memory_fts:
+            matched = conn.execute(
+                f"""
+                SELECT m.id, m.{column}, -bm25({table}_fts, 1.0, 0.0), {age.replace("created_at", "m.created_at")}
+                FROM {table}_fts JOIN {table} AS m ON m.id = {table}_fts.rowid
+                WHERE {table}_fts MATCH ?
+                ORDER BY bm25({table}_fts, 1.0, 0.0)
+                LIMIT ?
+                """,
+                (f"scope:{scope} AND ({query})", MEMORY_SEARCH_CANDIDATES)
+            ).fetchall()
+            for row_id, text, relevance, age_hours in matched:
+                candidates[row_id] = (text, relevance, age_hours or 0.0)
+
+        if not candidates:
+            return []
+        best_relevance = max(relevance for _, relevance, _ in candidates.values()) or 1.0
+
+        def score(item: tuple[int, tuple[str, float, float]]) -> float:
+            _, (_, relevance, age_hours) = item
+            recency = 0.5 ** (max(age_hours, 0.0) / MEMORY_RECENCY_HALF_LIFE_HOURS)
+            return (1 - MEMORY_RECENCY_WEIGHT) * relevance / best_relevance + MEMORY_RECENCY_WEIGHT * recency
+
+        pinned = [row_id for row_id, _, _ in recent[:MEMORY_MIN_RECENT_SHARE]]
+        ranked = [row_id for row_id, _ in sorted(candidates.items(), key=score, reverse=True) if row_id not in pinned]
+        return [candidates[row_id][0] for row_id in (pinned + ranked)[:limit]]
+
     def toggle_block(self, chat_id: int, blocker_id: int, blocked_id: int, personal_message: str = None):
         """Переключение блокировки (блокировать/разблокировать)"""
         conn = self.get_connection()
@@ -957,8 +2258,9 @@ class Database:
                 DELETE FROM blocks 
                 WHERE chat_id = ? AND blocker_id = ? AND blocked_id = ?
             ''', (chat_id, blocker_id, blocked_id))
+            self._update_block_counts(cursor, chat_id, blocker_id, blocked_id, -1)
             conn.commit()
-            conn.close()
+            self.block_index.set_block(chat_id, blocker_id, blocked_id, None, False)
             return False  # Разблокировано
         else:
             # Добавляем блокировку
@@ -966,52 +2268,84 @@ class Database:
                 INSERT INTO blocks (chat_id, blocker_id, blocked_id, personal_message)
                 VALUES (?, ?, ?, ?)
             ''', (chat_id, blocker_id, blocked_id, personal_message))
+            self._update_block_counts(cursor, chat_id, blocker_id, blocked_id, 1)
             conn.commit()
-            conn.close()
+            self.block_index.set_block(chat_id, blocker_id, blocked_id, personal_message, True)
             return True  # Заблокировано
     
-    def is_blocked(self, chat_id: int, blocker_id: int, blocked_id: int):
-        """Проверка, заблокирован ли пользователь"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT personal_message FROM blocks 
-            WHERE chat_id = ? AND blocker_id = ? AND blocked_id = ?
-        ''', (chat_id, blocker_id, blocked_id))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            return True, result[0]  # Заблокирован, персональное сообщение
-        return False, None
-    
-    def get_chat_blocks(self, chat_id: int):
-        """Получить все блокировки в чате"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT blocker_id, blocked_id FROM blocks 
-            WHERE chat_id = ?
-        ''', (chat_id,))
-        
-        results = cursor.fetchall()
-        conn.close()
-        return results
-
-    def get_blocks_by_blocker(self, chat_id: int, blocker_id: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''SELECT blocked_id FROM blocks WHERE chat_id = ? AND blocker_id = ?''',
-            (chat_id, blocker_id)
+    @staticmethod
+    def _update_block_counts(cursor: sqlite3.Cursor, chat_id: int, blocker_id: int, blocked_id: int, delta: int):
+        """Сдвигает счётчики в той же транзакции, что и изменение blocks."""
+        cursor.executemany(
+            """
+            INSERT INTO block_counts (chat_id, user_id, issued, received) VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id, user_id) DO UPDATE SET
+                issued = block_counts.issued + excluded.issued,
+                received = block_counts.received + excluded.received
+            """,
+            [(chat_id, blocker_id, delta, 0), (chat_id, blocked_id, 0, delta)]
         )
-        results = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return results
-    
+        if delta < 0:
+            cursor.execute(
+                "DELETE FROM block_counts WHERE chat_id = ? AND user_id IN (?, ?) AND issued <= 0 AND received <= 0",
+                (chat_id, blocker_id, blocked_id)
+            )
+
+    def _ranking_page(self, table: str, column: str, chat_id: int, cursor: tuple[int, int] | None,
+                      forward: bool, limit: int) -> list[tuple[int, int]]:
+        """Страница рейтинга по ключу (значение, user_id) вместо OFFSET.
+
+        forward — строки после cursor (последней строки текущей страницы), иначе — перед ним
+        (первой строкой); результат всегда в порядке рейтинга, до limit строк.
+        """
+        conditions = f"chat_id = ? AND {column} > 0"
+        params: list[Any] = [chat_id]
+        if cursor is not None:
+            value, user_id = cursor
+            if forward:
+                conditions += f" AND ({column} < ? OR ({column} = ? AND user_id > ?))"
+            else:
+                conditions += f" AND ({column} > ? OR ({column} = ? AND user_id < ?))"
+            params += [value, value, user_id]
+        order = f"{column} DESC, user_id ASC" if forward else f"{column} ASC, user_id DESC"
+        rows = self.get_connection().execute(
+            f"SELECT user_id, {column} FROM {table} WHERE {conditions} ORDER BY {order} LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+        return rows if forward else rows[::-1]
+
+    def get_block_ranking_page(self, chat_id: int, received: bool, cursor: tuple[int, int] | None,
+                               forward: bool, limit: int) -> list[tuple[int, int]]:
+        """Рейтинг по выданным (или полученным) блокировкам: строки (user_id, количество)."""
+        column = "received" if received else "issued"
+        return self._ranking_page("block_counts", column, chat_id, cursor, forward, limit)
+
+    def get_block_totals(self, chat_id: int, user_id: int) -> tuple[int, int]:
+        """(выдано, получено) блокировок пользователем в чате."""
+        row = self.get_connection().execute(
+            "SELECT issued, received FROM block_counts WHERE chat_id = ? AND user_id = ?",
+            (chat_id, user_id)
+        ).fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+
+    def get_blocks_page(self, chat_id: int, blocker_id: int, cursor: int | None,
+                        forward: bool, limit: int) -> list[tuple[int, int]]:
+        """Блокировки пользователя по порядку создания: строки (id, blocked_id) после/перед cursor."""
+        if cursor is None:
+            condition, params = "", (chat_id, blocker_id)
+        else:
+            condition, params = ("AND id > ?" if forward else "AND id < ?"), (chat_id, blocker_id, cursor)
+        rows = self.get_connection().execute(
+            f"""
+            SELECT id, blocked_id FROM blocks
+            WHERE chat_id = ? AND blocker_id = ? {condition}
+            ORDER BY id {"ASC" if forward else "DESC"}
+            LIMIT ?
+            """,
+            (*params, limit)
+        ).fetchall()
+        return rows if forward else rows[::-1]
+
     def set_global_autoresponder(self, user_id: int, message: str):
         """Установить глобальный автоответчик"""
         conn = self.get_connection()
@@ -1023,7 +2357,6 @@ class Database:
         ''', (user_id, message, datetime.now()))
         
         conn.commit()
-        conn.close()
     
     def get_global_autoresponder(self, user_id: int):
         """Получить глобальный автоответчик"""
@@ -1036,7 +2369,6 @@ class Database:
         ''', (user_id,))
         
         result = cursor.fetchone()
-        conn.close()
         
         return result[0] if result else None
     
@@ -1049,7 +2381,6 @@ class Database:
             (user_id, message)
         )
         conn.commit()
-        conn.close()
 
     def get_support_ban(self, user_id: int):
         conn = self.get_connection()
@@ -1059,7 +2390,6 @@ class Database:
             (user_id,)
         )
         row = cursor.fetchone()
-        conn.close()
         if not row:
             return None
         return {"block_media": bool(row[0]), "block_all": bool(row[1])}
@@ -1079,7 +2409,6 @@ class Database:
             (user_id, block_media, block_all)
         )
         conn.commit()
-        conn.close()
 
     def set_support_ban(self, user_id: int, *, block_media: bool | None = None, block_all: bool | None = None):
         current = self.get_support_ban(user_id) or {"block_media": False, "block_all": False}
@@ -1100,36 +2429,109 @@ class Database:
         self._upsert_support_ban(user_id, int(current["block_media"]), int(new_state))
         return new_state
 
-    def increment_swear(self, chat_id: int, user_id: int, amount: int = 1):
+    def increment_swear_batch(self, rows: list[tuple[int, int, int]]):
+        """Применяет пачку приращений (chat_id, user_id, amount) одной транзакцией."""
+        if not rows:
+            return
+        conn = self.get_connection()
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO swear_stats (chat_id, user_id, count)
+                VALUES (?, ?, ?)
+                ON CONFLICT(chat_id, user_id) DO UPDATE SET
+                    count = count + excluded.count
+                """,
+                rows
+            )
+
+    def get_shared_value(self, key: str) -> str | None:
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute(
-            """
-            INSERT INTO swear_stats (chat_id, user_id, count)
-            VALUES (?, ?, ?)
-            ON CONFLICT(chat_id, user_id) DO UPDATE SET
-                count = count + excluded.count
-            """,
-            (chat_id, user_id, amount)
+            "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
         )
-        conn.commit()
-        conn.close()
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def set_shared_value(self, key: str, value: str, expires_at: float | None = None) -> None:
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+
+    def delete_shared_value(self, key: str) -> None:
+        conn = self.get_connection()
+        with conn:
+            conn.execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def apply_shared_values(self, rows: list[tuple[str, str | None, float | None]]) -> None:
+        """Пачка записей (key, value, expires_at) одной транзакцией; value=None удаляет ключ."""
+        if not rows:
+            return
+        conn = self.get_connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                [row for row in rows if row[1] is not None]
+            )
+            conn.executemany(
+                "DELETE FROM shared_state WHERE key = ?",
+                [(row[0],) for row in rows if row[1] is None]
+            )
+
+    def purge_shared_values(self) -> int:
+        """Удаляет просроченные ключи shared_state."""
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (time.time(),)
+            )
+        return cursor.rowcount
+
+    def add_scheduled_deletion(self, chat_id: int, message_id: int, due_at: float) -> None:
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO scheduled_deletions (chat_id, message_id, due_at) VALUES (?, ?, ?)",
+                (chat_id, message_id, due_at)
+            )
+
+    def reschedule_deletions(self, rows: list[tuple[float, int, int]]) -> None:
+        """Переносит невыполненные удаления (due_at, chat_id, message_id) на новый срок одной транзакцией."""
+        if not rows:
+            return
+        conn = self.get_connection()
+        with conn:
+            conn.executemany(
+                "UPDATE scheduled_deletions SET due_at = ? WHERE chat_id = ? AND message_id = ?",
+                rows
+            )
+
+    def remove_scheduled_deletions(self, rows: list[tuple[int, int]]) -> None:
+        """Удаляет выполненные удаления (chat_id, message_id) одной транзакцией."""
+        if not rows:
+            return
+        conn = self.get_connection()
+        with conn:
+            conn.executemany(
+                "DELETE FROM scheduled_deletions WHERE chat_id = ? AND message_id = ?",
+                rows
+            )
 
-    def get_swear_ranking(self, chat_id: int, limit: int):
+    def get_scheduled_deletions(self) -> list[tuple[int, int, float]]:
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT user_id, count FROM swear_stats
-            WHERE chat_id = ?
-            ORDER BY count DESC, user_id ASC
-            LIMIT ?
-            """,
-            (chat_id, limit)
-        )
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        cursor.execute("SELECT chat_id, message_id, due_at FROM scheduled_deletions ORDER BY due_at")
+        return cursor.fetchall()
+
+    def get_swear_ranking_page(self, chat_id: int, cursor: tuple[int, int] | None,
+                               forward: bool, limit: int) -> list[tuple[int, int]]:
+        return self._ranking_page("swear_stats", "count", chat_id, cursor, forward, limit)
 
     def toggle_global_block(self, chat_id, blocker_id, message=None):
         """Вкл/выкл режима 'Спринг стоп все'"""
@@ -1146,7 +2548,7 @@ class Database:
                 (chat_id, blocker_id)
             )
             conn.commit()
-            conn.close()
+            self.block_index.set_global_block(chat_id, blocker_id, None, False)
             return False
         else:
             cursor.execute(
@@ -1159,23 +2561,9 @@ class Database:
                 (chat_id, blocker_id)
             )
             conn.commit()
-            conn.close()
+            self.block_index.set_global_block(chat_id, blocker_id, message, True)
             return True
 
-    def get_global_block(self, chat_id, blocker_id):
-        """Возвращает флаг и текст глобальной блокировки"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT message FROM global_blocks WHERE chat_id = ? AND blocker_id = ?",
-            (chat_id, blocker_id)
-        )
-        row = cursor.fetchone()
-        conn.close()
-        if row is None:
-            return False, None
-        return True, row[0]
-
     def toggle_global_block_exception(self, chat_id, blocker_id, allowed_id):
         """Тоггл исключения для режима 'Спринг стоп все'"""
         conn = self.get_connection()
@@ -1191,7 +2579,7 @@ class Database:
                 (chat_id, blocker_id, allowed_id)
             )
             conn.commit()
-            conn.close()
+            self.block_index.set_exception(chat_id, blocker_id, allowed_id, False)
             return False
         else:
             cursor.execute(
@@ -1199,99 +2587,797 @@ class Database:
                 (chat_id, blocker_id, allowed_id)
             )
             conn.commit()
-            conn.close()
+            self.block_index.set_exception(chat_id, blocker_id, allowed_id, True)
             return True
 
-    def is_global_block_exception(self, chat_id, blocker_id, allowed_id):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT 1 FROM global_block_exceptions WHERE chat_id = ? AND blocker_id = ? AND allowed_id = ?",
-            (chat_id, blocker_id, allowed_id)
-        )
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None
+    def upsert_user_profiles(self, rows: list[tuple[int, str | None, str | None, str | None]]):
+        """Сохраняет пачку профилей (user_id, username, first_name, last_name) одной транзакцией."""
+        if not rows:
+            return
+        conn = self.get_connection()
+        with conn:
+            for user_id, username, first_name, last_name in rows:
+                username_lower = username.lower() if username else None
+                if username_lower:
+                    # username мог перейти к другому пользователю — освобождаем его
+                    conn.execute(
+                        "UPDATE user_profiles SET username_lower = NULL WHERE username_lower = ? AND user_id != ?",
+                        (username_lower, user_id)
+                    )
+                conn.execute(
+                    """
+                    INSERT INTO user_profiles (user_id, username, username_lower, first_name, last_name, updated_at)
+                    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username = excluded.username,
+                        username_lower = excluded.username_lower,
+                        first_name = excluded.first_name,
+                        last_name = excluded.last_name,
+                        updated_at = CURRENT_TIMESTAMP
+                    """,
+                    (user_id, username, username_lower, first_name, last_name)
+                )
+
+    def get_user_by_username(self, username: str):
+        if not username:
+            return None
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT user_id, first_name, username FROM user_profiles WHERE username_lower = ?",
+            (username.lower(),)
+        )
+        row = cursor.fetchone()
+        if row:
+            return {
+                "user_id": row[0],
+                "first_name": row[1],
+                "username": row[2]
+            }
+        return None
+
+    def get_user_profiles(self, user_ids: list[int]) -> dict[int, tuple[str | None, str | None, str | None]]:
+        """Профили (username, first_name, last_name) по списку id; отсутствующих в ответе нет."""
+        profiles = {}
+        conn = self.get_connection()
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            rows = conn.execute(
+                f"SELECT user_id, username, first_name, last_name FROM user_profiles WHERE user_id IN ({placeholders})",
+                chunk
+            ).fetchall()
+            profiles.update({row[0]: (row[1], row[2], row[3]) for row in rows})
+        return profiles
+
+    def can_send_support_message(self, user_id, cooldown_seconds=30):
+        """Проверка, может ли пользователь отправить сообщение (антиспам)"""
+        import time
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        current_time = int(time.time())
+        
+        cursor.execute(
+            "SELECT last_message_time FROM last_support_time WHERE user_id = ?",
+            (user_id,)
+        )
+        result = cursor.fetchone()
+        
+        if result:
+            last_time = result[0]
+            time_passed = current_time - last_time
+            
+            if time_passed < cooldown_seconds:
+                return False, cooldown_seconds - time_passed
+        
+        # Обновляем время последнего сообщения
+        cursor.execute(
+            "INSERT OR REPLACE INTO last_support_time (user_id, last_message_time) VALUES (?, ?)",
+            (user_id, current_time)
+        )
+        conn.commit()
+        return True, 0
+
+
+class AsyncDatabase:
+    """Awaitable-обёртка над Database: чтения идут в пул потоков, записи — в один поток-писатель."""
+
+    READ_METHODS = frozenset({
+        "get_chat_setting",
+        "get_user_setting",
+        "search_chat_memories",
+        "search_user_memories",
+        "get_global_autoresponder",
+        "get_support_ban",
+        "get_scheduled_deletions",
+        "get_shared_value",
+        "get_user_by_username",
+        "get_user_profiles",
+        "get_block_ranking_page",
+        "get_block_totals",
+        "get_blocks_page",
+        "get_swear_ranking_page",
+    })
+
+    def __init__(self, database: Database, readers: int = DB_READER_THREADS):
+        self.database = database
+        self._readers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=readers,
+            thread_name_prefix="db-reader",
+            initializer=database.open_reader
+        )
+        self._write_queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self._writer.start()
+
+    def _writer_loop(self):
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                break
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as exc:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    async def read(self, func, *args, **kwargs):
+        """Выполняет чтение в пуле соединений только для чтения."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(func, *args, **kwargs))
+
+    async def write(self, func, *args, **kwargs):
+        """Ставит запись в очередь потока-писателя и ждёт результат."""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._write_queue.put((future, func, args, kwargs))
+        return await asyncio.wrap_future(future)
+
+    def __getattr__(self, name: str):
+        method = getattr(self.database, name)
+        if not callable(method):
+            return method
+        runner = self.read if name in self.READ_METHODS else self.write
+
+        async def call(*args, **kwargs):
+            return await runner(method, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+    def close(self):
+        """Дожидается очереди записей и останавливает потоки."""
+        self._write_queue.put(None)
+        self._writer.join()
+        self._readers.shutdown(wait=True)
+
+
+db = Database()
+adb = AsyncDatabase(db)
+register_metrics("memory_store", lambda: {"prunes": db.memory_prunes, "tracked_keys": len(db._memory_counts)})
+
+
+# ==================== Буферы записи ====================
+class SwearStatsBuffer:
+    """Копит приращения swear_stats в памяти и сбрасывает их в БД пачкой."""
+
+    def __init__(self, database: AsyncDatabase, max_pending: int = SWEAR_BUFFER_MAX_PENDING):
+        self.database = database
+        self.max_pending = max_pending
+        self._pending: dict[tuple[int, int], int] = {}
+        self._lock = asyncio.Lock()
+        self.increments = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    async def add(self, chat_id: int, user_id: int, amount: int) -> None:
+        key = (chat_id, user_id)
+        self._pending[key] = self._pending.get(key, 0) + amount
+        self.increments += 1
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            batch = self._pending
+            self._pending = {}
+            rows = [(chat_id, user_id, amount) for (chat_id, user_id), amount in batch.items()]
+            try:
+                await self.database.increment_swear_batch(rows)
+            except Exception:
+                # Возвращаем приращения обратно, чтобы не потерять их до следующей попытки
+                for key, amount in batch.items():
+                    self._pending[key] = self._pending.get(key, 0) + amount
+                raise
+            self.flushes += 1
+            self.flushed_rows += len(rows)
+
+    def has_pending(self, chat_id: int) -> bool:
+        return any(pending_chat == chat_id for pending_chat, _ in self._pending)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "increments": self.increments,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+        }
+
+
+swear_buffer = SwearStatsBuffer(adb)
+register_metrics("swear_buffer", swear_buffer.stats)
+
+
+class UserProfileCache:
+    """Отпечатки (username, first_name, last_name): в БД уходят только изменившиеся профили, пачками."""
+
+    def __init__(self, database: AsyncDatabase, max_size: int = PROFILE_CACHE_SIZE,
+                 max_pending: int = PROFILE_BUFFER_MAX_PENDING):
+        self.database = database
+        self.max_size = max_size
+        self.max_pending = max_pending
+        self._fingerprints: OrderedDict[int, tuple[str | None, str | None, str | None]] = OrderedDict()
+        self._pending: dict[int, tuple[str | None, str | None, str | None]] = {}
+        self._pending_usernames: dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    async def record(self, user) -> None:
+        if user is None:
+            return
+        user_id = getattr(user, "id", None)
+        if user_id is None:
+            return
+        fingerprint = (
+            getattr(user, "username", None),
+            getattr(user, "first_name", None),
+            getattr(user, "last_name", None)
+        )
+        if self._fingerprints.get(user_id) == fingerprint:
+            self._fingerprints.move_to_end(user_id)
+            self.hits += 1
+            return
+        self.misses += 1
+        self._fingerprints[user_id] = fingerprint
+        self._fingerprints.move_to_end(user_id)
+        while len(self._fingerprints) > self.max_size:
+            self._fingerprints.popitem(last=False)
+        self._queue(user_id, fingerprint)
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+    def _queue(self, user_id: int, fingerprint: tuple[str | None, str | None, str | None]) -> None:
+        self._pending[user_id] = fingerprint
+        if fingerprint[0]:
+            self._pending_usernames[fingerprint[0].lower()] = user_id
+
+    def lookup(self, user_id: int) -> tuple[str | None, str | None, str | None] | None:
+        """Последний увиденный профиль пользователя, если он ещё в памяти."""
+        return self._fingerprints.get(user_id)
+
+    def find_pending(self, username: str) -> dict | None:
+        """Профиль по username среди ещё не сохранённых изменений."""
+        user_id = self._pending_usernames.get(username.lower())
+        if user_id is None:
+            return None
+        pending_username, first_name, _ = self._pending.get(user_id, (None, None, None))
+        if not pending_username or pending_username.lower() != username.lower():
+            return None
+        return {"user_id": user_id, "first_name": first_name, "username": pending_username}
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            batch = self._pending
+            self._pending = {}
+            self._pending_usernames = {}
+            rows = [(user_id, *fingerprint) for user_id, fingerprint in batch.items()]
+            try:
+                await self.database.upsert_user_profiles(rows)
+            except Exception:
+                for user_id, fingerprint in batch.items():
+                    if user_id not in self._pending:
+                        self._queue(user_id, fingerprint)
+                raise
+            self.flushes += 1
+            self.flushed_rows += len(rows)
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "cached": len(self._fingerprints),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+        }
+
+
+profile_cache = UserProfileCache(adb)
+register_metrics("profile_cache", profile_cache.stats)
+
+
+async def find_user_by_username(username: str) -> dict | None:
+    return profile_cache.find_pending(username) or await adb.get_user_by_username(username)
+
+
+def format_profile_name(username: str | None, first_name: str | None, last_name: str | None) -> str | None:
+    full_name = " ".join(part for part in (first_name, last_name) if part)
+    if full_name:
+        return full_name
+    if username:
+        return f"@{username}"
+    return None
+
+
+class NameResolver:
+    """Имена для рейтингов: сначала память и user_profiles, в API — только промахи, параллельно.
+
+    Профили, полученные через getChatMember, записываются обратно через profile_cache,
+    так что повторный запрос того же пользователя обходится без API.
+    """
+
+    def __init__(self, database: AsyncDatabase, profiles: UserProfileCache,
+                 concurrency: int = NAME_FETCH_CONCURRENCY):
+        self.database = database
+        self.profiles = profiles
+        self.names = TTLCache("names", NAME_CACHE_SIZE, lambda name: NAME_CACHE_TTL if name else NAME_MISS_TTL)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.from_memory = 0
+        self.from_db = 0
+        self.from_api = 0
+
+    async def resolve(self, chat_id: int, user_ids: list[int]) -> dict[int, str]:
+        resolved: dict[int, str | None] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            fingerprint = self.profiles.lookup(user_id)
+            name = format_profile_name(*fingerprint) if fingerprint else self.names.get(user_id)
+            if name:
+                resolved[user_id] = name
+                self.from_memory += 1
+            else:
+                missing.append(user_id)
+
+        if missing:
+            stored = await self.database.get_user_profiles(missing)
+            for user_id, profile in stored.items():
+                name = format_profile_name(*profile)
+                if name:
+                    resolved[user_id] = name
+                    self.names.set(user_id, name)
+                    self.from_db += 1
+            missing = [user_id for user_id in missing if user_id not in resolved]
+
+        if missing:
+            fetched = await asyncio.gather(*(
+                self.names.get_or_load(user_id, lambda user_id=user_id: self._fetch(chat_id, user_id))
+                for user_id in missing
+            ))
+            resolved.update(zip(missing, fetched))
+
+        return {user_id: resolved.get(user_id) or f"ID{user_id}" for user_id in user_ids}
+
+    async def _fetch(self, chat_id: int, user_id: int) -> str | None:
+        async with self._semaphore:
+            try:
+                member = await bot.get_chat_member(chat_id, user_id)
+            except Exception:
+                return None
+        self.from_api += 1
+        await self.profiles.record(member.user)
+        return format_profile_name(member.user.username, member.user.first_name, member.user.last_name)
+
+    def stats(self) -> dict[str, Any]:
+        return {"memory": self.from_memory, "db": self.from_db, "api": self.from_api}
+
+
+name_resolver = NameResolver(adb, profile_cache)
+register_metrics("names", name_resolver.stats)
+
+# ==================== Общее состояние и шардирование ====================
+class SharedStore(ABC):
+    """Общее для всех воркеров хранилище ключ-значение с TTL."""
+
+    @abstractmethod
+    async def get(self, key: str) -> str | None:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    async def set_many(self, items: list[tuple[str, str | None, float | None]]) -> None:
+        """Пачка записей (key, value, ttl); value=None удаляет ключ."""
+        for key, value, ttl in items:
+            if value is None:
+                await self.delete(key)
+            else:
+                await self.set(key, value, ttl)
+
+    async def purge_expired(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteSharedStore(SharedStore):
+    """SharedStore в таблице shared_state того же файла БД (WAL позволяет писать из нескольких процессов)."""
+
+    def __init__(self, database: AsyncDatabase):
+        self.database = database
+
+    async def get(self, key: str) -> str | None:
+        return await self.database.get_shared_value(key)
+
+    async def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        await self.database.set_shared_value(key, value, expires_at)
+
+    async def delete(self, key: str) -> None:
+        await self.database.delete_shared_value(key)
+
+    async def set_many(self, items: list[tuple[str, str | None, float | None]]) -> None:
+        now = time.time()
+        await self.database.apply_shared_values([
+            (key, value, now + ttl if ttl else None) for key, value, ttl in items
+        ])
+
+    async def purge_expired(self) -> None:
+        removed = await self.database.purge_shared_values()
+        if removed:
+            logger.info(f"Удалено просроченных ключей общего состояния: {removed}")
+
+
+class RespError(Exception):
+    pass
+
+
+class RespSharedStore(SharedStore):
+    """SharedStore на сервере с протоколом Redis (RESP2): Redis, KeyDB или локальная заглушка.
+
+    Одно соединение, команды сериализуются замком, пачки отправляются конвейером.
+    """
+
+    def __init__(self, url: str = REDIS_URL, timeout: float = REDIS_TIMEOUT):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db_index = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(*args: Any) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("RESP-сервер закрыл соединение")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RespError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if prefix == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [await self._read_reply() for _ in range(count)]
+        raise RespError(f"Неизвестный ответ RESP: {line!r}")
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout=self.timeout
+        )
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db_index:
+            setup.append(("SELECT", self.db_index))
+        if setup:
+            await self._send(setup)
+
+    async def _send(self, commands: list[tuple]) -> list[Any]:
+        self._writer.write(b"".join(self._encode(*command) for command in commands))
+        await self._writer.drain()
+        return [await asyncio.wait_for(self._read_reply(), timeout=self.timeout) for _ in commands]
+
+    async def execute(self, commands: list[tuple]) -> list[Any]:
+        async with self._lock:
+            if self._writer is None or self._writer.is_closing():
+                await self._connect()
+            try:
+                return await self._send(commands)
+            except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                self._writer.close()
+                self._writer = None
+                raise
+
+    async def get(self, key: str) -> str | None:
+        return (await self.execute([("GET", key)]))[0]
+
+    async def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        await self.set_many([(key, value, ttl)])
+
+    async def delete(self, key: str) -> None:
+        await self.execute([("DEL", key)])
+
+    async def set_many(self, items: list[tuple[str, str | None, float | None]]) -> None:
+        commands = []
+        for key, value, ttl in items:
+            if value is None:
+                commands.append(("DEL", key))
+            elif ttl:
+                commands.append(("SET", key, value, "PX", int(ttl * 1000)))
+            else:
+                commands.append(("SET", key, value))
+        if commands:
+            await self.execute(commands)
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+SHARED_STORE_BACKENDS: dict[str, Callable[[], SharedStore]] = {
+    "sqlite": lambda: SQLiteSharedStore(adb),
+    "redis": lambda: RespSharedStore(REDIS_URL),
+}
+
+
+def create_shared_store(backend: str = SHARED_STORE_BACKEND) -> SharedStore:
+    factory = SHARED_STORE_BACKENDS.get(backend)
+    if factory is None:
+        raise ValueError(f"Неизвестное хранилище общего состояния: {backend}")
+    return factory()
+
+
+shared_store = create_shared_store()
+
+
+class StoreFSMStorage(BaseStorage):
+    """FSM-хранилище поверх SharedStore: переживает перезапуск и видно всем воркерам.
+
+    Состояние и данные ключа лежат одним JSON с TTL (брошенные диалоги истекают сами).
+    Чтения идут из LRU-кэша процесса, записи копятся и уходят в хранилище пачкой.
+    Кэшу можно доверять: апдейты одного чата всегда обрабатывает один процесс.
+    """
+
+    def __init__(self, store: SharedStore, ttl: float = FSM_STATE_TTL, cache_size: int = FSM_CACHE_SIZE,
+                 max_pending: int = FSM_BUFFER_MAX_PENDING):
+        self.store = store
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.max_pending = max_pending
+        self._cache: OrderedDict[str, tuple[dict | None, float]] = OrderedDict()
+        self._pending: dict[str, dict | None] = {}
+        self._flush_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"fsm:{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or 0}:{key.destiny}"
+
+    async def _load(self, key: StorageKey) -> dict:
+        store_key = self._key(key)
+        cached = self._cache.get(store_key)
+        now = time.time()
+        if cached is not None and cached[1] > now:
+            self._cache.move_to_end(store_key)
+            self.hits += 1
+            return dict(cached[0] or {})
+        self.misses += 1
+        if store_key in self._pending:
+            # Запись вытеснена из кэша, но ещё не ушла в хранилище
+            record = self._pending[store_key]
+        else:
+            raw = await self.store.get(store_key)
+            record = json.loads(raw) if raw else None
+        self._remember(store_key, record, now)
+        return dict(record or {})
+
+    def _remember(self, store_key: str, record: dict | None, now: float) -> None:
+        self._cache[store_key] = (record, now + self.ttl)
+        self._cache.move_to_end(store_key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _save(self, key: StorageKey, record: dict) -> None:
+        store_key = self._key(key)
+        if not record.get("state") and not record.get("data"):
+            record = None
+        self._remember(store_key, record, time.time())
+        self._pending[store_key] = record
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._load(key)
+        record["state"] = state.state if isinstance(state, State) else state
+        await self._save(key, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._load(key)).get("state")
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        record = await self._load(key)
+        record["data"] = data
+        await self._save(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict((await self._load(key)).get("data") or {})
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch = self._pending
+            self._pending = {}
+            items = [
+                (store_key, json.dumps(record, ensure_ascii=False) if record else None, self.ttl)
+                for store_key, record in batch.items()
+            ]
+            try:
+                await self.store.set_many(items)
+            except Exception:
+                for store_key, record in batch.items():
+                    self._pending.setdefault(store_key, record)
+                raise
+            self.flushes += 1
+            self.flushed_rows += len(items)
+
+    async def close(self) -> None:
+        try:
+            await self.flush()
+        except Exception as exc:
+            logger.error(f"Не удалось сохранить состояния FSM при остановке: {exc}")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "backend": type(self.store).__name__,
+            "cached": len(self._cache),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+        }
+
+
+fsm_storage = StoreFSMStorage(shared_store)
+dp.fsm.storage = fsm_storage
+register_metrics("fsm", fsm_storage.stats)
+
+
+class ConsistentHashRing:
+    """Кольцо консистентного хеширования: при смене числа воркеров переезжает лишь часть чатов."""
+
+    def __init__(self, nodes: int, replicas: int = SHARD_VIRTUAL_NODES):
+        points = sorted(
+            (self._hash(f"worker-{node}:{replica}"), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+    def node_for(self, key: int) -> int:
+        index = bisect.bisect(self._points, self._hash(str(key))) % len(self._points)
+        return self._nodes[index]
+
+
+def update_shard_key(raw_update: dict) -> int:
+    """Ключ шарда апдейта: id чата, для событий без чата (inline и т.п.) — id пользователя."""
+    for field, payload in raw_update.items():
+        if field == "update_id" or not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+WORKER_INDEX: int | None = None
+shard_ring: ConsistentHashRing | None = None
+
+
+def owns_chat(chat_id: int) -> bool:
+    """Обрабатывает ли текущий процесс этот чат (в одиночном режиме — всегда да)."""
+    return shard_ring is None or shard_ring.node_for(chat_id) == WORKER_INDEX
+
+
+class InvalidationBus:
+    """Рассылка инвалидаций кэшей другим воркерам через процесс-приёмник.
+
+    Свой процесс уже обновил кэш сам, поэтому publish уходит только остальным;
+    в одиночном режиме это просто счётчик.
+    """
+
+    def __init__(self):
+        self._handlers: dict[str, list[Callable[[Any], Any]]] = {}
+        self._outbox = None
+        self.published = 0
+        self.applied = 0
+
+    def subscribe(self, kind: str, handler: Callable[[Any], Any]) -> None:
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def attach(self, outbox) -> None:
+        self._outbox = outbox
+
+    def publish(self, kind: str, key: Any) -> None:
+        self.published += 1
+        if self._outbox is not None:
+            self._outbox.put((WORKER_INDEX, kind, key))
+
+    async def apply(self, kind: str, key: Any) -> None:
+        self.applied += 1
+        for handler in self._handlers.get(kind, ()):
+            result = handler(key)
+            if asyncio.iscoroutine(result):
+                await result
+
+    def stats(self) -> dict[str, Any]:
+        return {"worker": WORKER_INDEX, "published": self.published, "applied": self.applied}
+
 
-    def upsert_user_profile(self, user):
-        if user is None:
-            return
-        user_id = getattr(user, "id", None)
-        if user_id is None:
-            return
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        username = getattr(user, "username", None)
-        username_lower = username.lower() if username else None
-        first_name = getattr(user, "first_name", None)
-        last_name = getattr(user, "last_name", None)
-        cursor.execute(
-            """
-            INSERT INTO user_profiles (user_id, username, username_lower, first_name, last_name, updated_at)
-            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(user_id) DO UPDATE SET
-                username = excluded.username,
-                username_lower = excluded.username_lower,
-                first_name = excluded.first_name,
-                last_name = excluded.last_name,
-                updated_at = CURRENT_TIMESTAMP
-            """,
-            (user_id, username, username_lower, first_name, last_name)
-        )
-        conn.commit()
-        conn.close()
+def _drop_user_style(user_id: int) -> None:
+    user_style_cache.pop(user_id)
+    user_custom_prompt_cache.pop(user_id)
 
-    def get_user_by_username(self, username: str):
-        if not username:
-            return None
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT user_id, first_name, username FROM user_profiles WHERE username_lower = ?",
-            (username.lower(),)
-        )
-        row = cursor.fetchone()
-        conn.close()
-        if row:
-            return {
-                "user_id": row[0],
-                "first_name": row[1],
-                "username": row[2]
-            }
-        return None
 
-    def can_send_support_message(self, user_id, cooldown_seconds=30):
-        """Проверка, может ли пользователь отправить сообщение (антиспам)"""
-        import time
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        current_time = int(time.time())
-        
-        cursor.execute(
-            "SELECT last_message_time FROM last_support_time WHERE user_id = ?",
-            (user_id,)
-        )
-        result = cursor.fetchone()
-        
-        if result:
-            last_time = result[0]
-            time_passed = current_time - last_time
-            
-            if time_passed < cooldown_seconds:
-                conn.close()
-                return False, cooldown_seconds - time_passed
-        
-        # Обновляем время последнего сообщения
-        cursor.execute(
-            "INSERT OR REPLACE INTO last_support_time (user_id, last_message_time) VALUES (?, ?)",
-            (user_id, current_time)
-        )
-        conn.commit()
-        conn.close()
-        return True, 0
+invalidation_bus = InvalidationBus()
+invalidation_bus.subscribe("user_style", _drop_user_style)
+invalidation_bus.subscribe("ai_style", lambda _: ai_style_cache.pop(GLOBAL_STYLE_SCOPE))
+invalidation_bus.subscribe("subscription", subscription_cache.pop)
+invalidation_bus.subscribe("autoresponder", autoresponder_cache.pop)
+register_metrics("shards", invalidation_bus.stats)
 
-db = Database()
 
 # ==================== FSM States ====================
 class BotStates(StatesGroup):
@@ -1324,24 +3410,99 @@ SUBSCRIBE_GROUP_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
 ])
 
 
-async def is_user_subscribed(user_id: int) -> bool:
-    if not REQUIRED_CHANNEL:
-        return True
-    now = time.time()
-    cached = subscription_cache.get(user_id)
-    if cached and cached[1] > now:
-        return cached[0]
+SUBSCRIBED_STATUSES = {"member", "administrator", "creator"}
+subscription_rechecks: dict[int, float] = {}
+
+
+def subscription_ttl(subscribed: bool) -> float:
+    if subscription_events_enabled:
+        return SUBSCRIPTION_EVENT_TTL
+    return SUBSCRIPTION_CACHE_TTL_OK if subscribed else SUBSCRIPTION_CACHE_TTL_FAIL
+
+
+async def store_subscription_status(user_id: int, status: bool, previous: bool | None) -> None:
+    """Сохраняет статус в общем хранилище и сообщает другим воркерам, если он изменился."""
+    await shared_store.set(f"subscription:{user_id}", "1" if status else "0", subscription_ttl(status))
+    if previous is not None and previous != status:
+        invalidation_bus.publish("subscription", user_id)
+
+
+async def load_subscription_status(user_id: int, use_shared: bool = True) -> bool:
+    previous = subscription_cache.peek(user_id)
+    if use_shared:
+        shared = await shared_store.get(f"subscription:{user_id}")
+        if shared is not None:
+            return shared == "1"
     try:
         member = await bot.get_chat_member(REQUIRED_CHANNEL, user_id)
-        status = member.status in {"member", "administrator", "creator"}
+        status = member.status in SUBSCRIBED_STATUSES or getattr(member, "is_member", False)
     except TelegramBadRequest:
         status = False
 
-    ttl = SUBSCRIPTION_CACHE_TTL_OK if status else SUBSCRIPTION_CACHE_TTL_FAIL
-    subscription_cache[user_id] = (status, now + ttl)
+    await store_subscription_status(user_id, status, previous)
     return status
 
 
+async def is_user_subscribed(user_id: int) -> bool:
+    if not REQUIRED_CHANNEL:
+        return True
+    return await subscription_cache.get_or_load(user_id, lambda: load_subscription_status(user_id))
+
+
+async def recheck_subscription(user_id: int) -> bool:
+    """Проверка по кнопке: положительный кэш отвечает сразу, иначе — запрос к API не чаще раза в несколько секунд."""
+    if subscription_cache.get(user_id):
+        return True
+    now = time.monotonic()
+    throttled = now - subscription_rechecks.get(user_id, 0.0) < SUBSCRIPTION_RECHECK_INTERVAL
+    if throttled and not subscription_cache.loading(user_id):
+        return await is_user_subscribed(user_id)
+    subscription_rechecks[user_id] = now
+    if len(subscription_rechecks) > SUBSCRIPTION_CACHE_SIZE:
+        subscription_rechecks.clear()
+    return await subscription_cache.get_or_load(
+        user_id, lambda: load_subscription_status(user_id, use_shared=False), refresh=True
+    )
+
+
+def is_required_channel(chat: types.Chat) -> bool:
+    if not REQUIRED_CHANNEL:
+        return False
+    if REQUIRED_CHANNEL.startswith("@"):
+        return (chat.username or "").lower() == REQUIRED_CHANNEL[1:].lower()
+    return str(chat.id) == str(REQUIRED_CHANNEL)
+
+
+async def detect_subscription_events() -> None:
+    """Если бот — администратор канала, Telegram присылает chat_member и опрос можно сделать редким."""
+    global subscription_events_enabled
+    if not REQUIRED_CHANNEL or not BOT_ID:
+        return
+    try:
+        member = await bot.get_chat_member(REQUIRED_CHANNEL, BOT_ID)
+    except Exception as exc:
+        # Это лишь настройка частоты опроса: любая ошибка не должна мешать запуску
+        logger.warning(f"Не удалось проверить права бота в канале {REQUIRED_CHANNEL}: {exc}")
+        return
+    subscription_events_enabled = member.status in {"administrator", "creator"}
+    if subscription_events_enabled:
+        logger.info(f"Подписка на {REQUIRED_CHANNEL} отслеживается по событиям chat_member")
+    else:
+        logger.info(f"Бот не администратор {REQUIRED_CHANNEL}, подписка проверяется запросами")
+
+
+@dp.chat_member(F.chat.type == "channel")
+async def on_channel_member_update(event: types.ChatMemberUpdated):
+    if not is_required_channel(event.chat):
+        return
+    member = event.new_chat_member
+    status = member.status in SUBSCRIBED_STATUSES or getattr(member, "is_member", False)
+    user_id = member.user.id
+    subscription_cache.set(user_id, status)
+    await shared_store.set(f"subscription:{user_id}", "1" if status else "0", subscription_ttl(status))
+    invalidation_bus.publish("subscription", user_id)
+
+
 async def ensure_channel_subscription(message: types.Message) -> bool:
     if message.chat.type != "private" or not REQUIRED_CHANNEL:
         return True
@@ -1367,8 +3528,8 @@ async def ensure_group_subscription(message: types.Message) -> bool:
     return False
 
 
-def build_support_admin_keyboard(user_id: int) -> InlineKeyboardMarkup:
-    ban_info = db.get_support_ban(user_id) or {"block_media": False, "block_all": False}
+async def build_support_admin_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    ban_info = await adb.get_support_ban(user_id) or {"block_media": False, "block_all": False}
     media_text = "🚫 Запретить медиа" if not ban_info["block_media"] else "♻️ Разрешить медиа"
     full_text = "⛔️ Полный бан" if not ban_info["block_all"] else "♻️ Разрешить пользователя"
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -1380,26 +3541,337 @@ def build_support_admin_keyboard(user_id: int) -> InlineKeyboardMarkup:
     ])
 
 
-async def send_temp_answer(message: types.Message, text: str, *, delay: int = 20, **kwargs) -> None:
+# ==================== Автоудаление сообщений ====================
+class DeletionBatcher:
+    """Собирает удаления по чатам за короткое окно и отправляет их одним deleteMessages.
+
+    Одиночное удаление идёт через deleteMessage; если Telegram отклонил пакетный вызов,
+    сообщения удаляются по одному, чтобы каждый вызывающий получил свой результат.
+    Flood-ожидания обрабатывает только SendScheduler, здесь повторов нет.
+    """
+
+    def __init__(self, window: float = DELETE_BATCH_WINDOW, max_batch: int = DELETE_BATCH_MAX_SIZE):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: dict[int, list[tuple[int, asyncio.Future]]] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.requested = 0
+        self.bulk_calls = 0
+        self.single_calls = 0
+        self.fallbacks = 0
+
+    async def delete(self, chat_id: int, message_id: int) -> None:
+        """Удаляет сообщение в составе ближайшей пачки; ошибка удаления пробрасывается."""
+        await self.submit(chat_id, message_id)
+
+    def submit(self, chat_id: int, message_id: int) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(chat_id, [])
+        pending.append((message_id, future))
+        self.requested += 1
+        if len(pending) >= self.max_batch:
+            self.flush_chat(chat_id)
+        elif chat_id not in self._timers:
+            self._timers[chat_id] = loop.call_later(self.window, self.flush_chat, chat_id)
+        return future
+
+    def flush_chat(self, chat_id: int) -> None:
+        """Отправляет накопленную пачку чата, не дожидаясь окна."""
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(chat_id, None)
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(chat_id, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, chat_id: int, batch: list[tuple[int, asyncio.Future]]) -> None:
+        try:
+            if len(batch) == 1:
+                self.single_calls += 1
+                await bot.delete_message(chat_id, batch[0][0])
+            else:
+                self.bulk_calls += 1
+                await bot.delete_messages(chat_id, [message_id for message_id, _ in batch])
+        except TelegramBadRequest as exc:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(exc)
+                return
+            self.fallbacks += 1
+            logger.debug(f"Пакетное удаление в чате {chat_id} не удалось, удаляем по одному: {exc}")
+            for item in batch:
+                await self._send(chat_id, [item])
+            return
+        except Exception as exc:
+            # Flood-ожидания и сетевые повторы уже отработал SendScheduler — отдаём ошибку вызывающим
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def close(self) -> None:
+        """Отправляет все накопленные пачки и дожидается их."""
+        for chat_id in list(self._pending):
+            self.flush_chat(chat_id)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": sum(len(batch) for batch in self._pending.values()),
+            "requested": self.requested,
+            "bulk_calls": self.bulk_calls,
+            "single_calls": self.single_calls,
+            "fallbacks": self.fallbacks,
+        }
+
+
+deletion_batcher = DeletionBatcher()
+register_metrics("delete_batches", deletion_batcher.stats)
+
+
+class DeletionScheduler:
+    """Единый планировщик автоудаления: куча сроков в памяти и её копия в scheduled_deletions.
+
+    Вместо спящей задачи на каждое уведомление один цикл ждёт ближайший срок, а созревшие
+    удаления группирует по чатам и отправляет пачками через DeletionBatcher с ограничением скорости.
+    """
+
+    def __init__(self, database: AsyncDatabase, batcher: DeletionBatcher, rate: float = DELETION_RATE_PER_SECOND,
+                 batch_limit: int = DELETION_BATCH_LIMIT):
+        self.database = database
+        self.batcher = batcher
+        self.min_interval = 1.0 / rate
+        self.batch_limit = batch_limit
+        self._heap: list[tuple[float, int, int]] = []
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._next_send_at = 0.0
+        self.scheduled = 0
+        self.resumed = 0
+        self.deleted = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def schedule(self, chat_id: int, message_id: int, delay: float) -> None:
+        due_at = time.time() + delay
+        await self.database.add_scheduled_deletion(chat_id, message_id, due_at)
+        self._push(due_at, chat_id, message_id)
+        self.scheduled += 1
+
+    def _push(self, due_at: float, chat_id: int, message_id: int) -> None:
+        heapq.heappush(self._heap, (due_at, chat_id, message_id))
+        if self._heap[0][0] == due_at:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        """Поднимает сохранённые удаления из БД (просроченные уйдут сразу) и запускает цикл."""
+        rows = [row for row in await self.database.get_scheduled_deletions() if owns_chat(row[0])]
+        now = time.time()
+        for chat_id, message_id, due_at in rows:
+            self._push(due_at, chat_id, message_id)
+        self.resumed = sum(1 for _, _, due_at in rows if due_at <= now)
+        if rows:
+            logger.info(f"Восстановлено отложенных удалений: {len(rows)}, просрочено: {self.resumed}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает цикл; невыполненные удаления остаются в БД до следующего запуска."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._heap.clear()
+
+    async def _run(self) -> None:
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_limit:
+                due.append(heapq.heappop(self._heap))
+            try:
+                await self._delete_due(due)
+            except Exception as exc:
+                logger.warning(f"Ошибка при пакетном удалении сообщений: {exc}")
+
+    async def _delete_due(self, due: list[tuple[float, int, int]]) -> None:
+        now = time.time()
+        by_chat: dict[int, list[int]] = {}
+        for due_at, chat_id, message_id in due:
+            stage_timings.record("deletion.lag", max(0.0, now - due_at))
+            by_chat.setdefault(chat_id, []).append(message_id)
+
+        futures: list[asyncio.Future] = []
+        attempted: list[tuple[int, int]] = []
+        for chat_id, message_ids in by_chat.items():
+            for start in range(0, len(message_ids), self.batcher.max_batch):
+                chunk = message_ids[start:start + self.batcher.max_batch]
+                wait = self._next_send_at - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._next_send_at = time.monotonic() + self.min_interval
+                futures.extend(self.batcher.submit(chat_id, message_id) for message_id in chunk)
+                self.batcher.flush_chat(chat_id)
+                attempted.extend((chat_id, message_id) for message_id in chunk)
+
+        done: list[tuple[int, int]] = []
+        retry: list[tuple[float, int, int]] = []
+        retry_at = time.time() + DELETION_RETRY_DELAY
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for (chat_id, message_id), result in zip(attempted, results):
+            if isinstance(result, TelegramBadRequest):
+                # Сообщения уже нет или его нельзя удалить — повтор не поможет
+                self.failed += 1
+                logger.debug(f"Не удалось удалить временное сообщение: {result}")
+                done.append((chat_id, message_id))
+            elif isinstance(result, BaseException):
+                # Временная ошибка (flood, сеть): строка остаётся в БД, пробуем позже
+                retry.append((retry_at, chat_id, message_id))
+            else:
+                self.deleted += 1
+                done.append((chat_id, message_id))
+        await self.database.remove_scheduled_deletions(done)
+        await self.database.reschedule_deletions(retry)
+        for row in retry:
+            self._push(*row)
+        self.retried += len(retry)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": len(self._heap),
+            "scheduled": self.scheduled,
+            "resumed": self.resumed,
+            "deleted": self.deleted,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+
+deletion_scheduler = DeletionScheduler(adb, deletion_batcher)
+register_metrics("deletions", deletion_scheduler.stats)
+
+
+async def send_temp_answer(message: types.Message, text: str, *, delay: int = TEMP_MESSAGE_DELAY,
+                           **kwargs) -> types.Message:
     """Отправляет ответ, который автоматически удалится через delay секунд."""
     sent_message = await message.answer(text, **kwargs)
+    await deletion_scheduler.schedule(sent_message.chat.id, sent_message.message_id, delay)
+    return sent_message
+
+
+class _Notice:
+    __slots__ = ("message_id", "text", "count", "expires_at", "edited_at")
+
+    def __init__(self, text: str, expires_at: float):
+        self.message_id: int | None = None
+        self.text = text
+        self.count = 1
+        self.expires_at = expires_at
+        self.edited_at = 0.0
+
+
+class NoticeCoalescer:
+    """Одно уведомление автоответчика на (чат, блокирующий, отвечающий), пока оно живо.
+
+    Повторные нарушения в течение ttl не шлют новое сообщение: живое уведомление
+    редактируется со счётчиком не чаще раза в edit_window секунд, остальные подавляются.
+    ttl должен быть меньше времени жизни временного сообщения, чтобы не править удалённое.
+    """
+
+    def __init__(self, ttl: float = NOTICE_COALESCE_TTL, edit_window: float = NOTICE_COALESCE_EDIT_WINDOW):
+        self.ttl = ttl
+        self.edit_window = edit_window
+        self._notices: dict[tuple[int, int, int], _Notice] = {}
+        self._next_prune = 0.0
+        self.sent = 0
+        self.edited = 0
+        self.suppressed = 0
+
+    async def notify(self, message: types.Message, blocker_id: int, text: str) -> None:
+        now = time.monotonic()
+        key = (message.chat.id, blocker_id, message.from_user.id)
+        notice = self._notices.get(key)
+        if notice is not None and notice.expires_at > now:
+            notice.count += 1
+            if notice.message_id is None or now - notice.edited_at < self.edit_window:
+                self.suppressed += 1
+                return
+            notice.edited_at = now
+            try:
+                await bot.edit_message_text(
+                    f"{notice.text}\n\n🔁 Повторных попыток: {notice.count - 1}",
+                    chat_id=message.chat.id,
+                    message_id=notice.message_id,
+                    parse_mode="HTML"
+                )
+                self.edited += 1
+                return
+            except TelegramBadRequest as exc:
+                logger.debug(f"Не удалось обновить уведомление, отправляем новое: {exc}")
 
-    async def _delete_later():
+        self._prune(now)
+        notice = self._notices[key] = _Notice(text, now + self.ttl)
         try:
-            await asyncio.sleep(delay)
-            await sent_message.delete()
-        except Exception as e:
-            logger.debug(f"Не удалось удалить временное сообщение: {e}")
+            sent_message = await send_temp_answer(message, text, parse_mode="HTML")
+        except Exception:
+            self._notices.pop(key, None)
+            raise
+        notice.message_id = sent_message.message_id
+        notice.edited_at = time.monotonic()
+        self.sent += 1
+
+    def _prune(self, now: float) -> None:
+        if now < self._next_prune:
+            return
+        self._next_prune = now + self.ttl
+        expired = [key for key, notice in self._notices.items() if notice.expires_at <= now]
+        for key in expired:
+            del self._notices[key]
 
-    asyncio.create_task(_delete_later())
+    def stats(self) -> dict[str, Any]:
+        return {
+            "active": len(self._notices),
+            "sent": self.sent,
+            "edited": self.edited,
+            "suppressed": self.suppressed,
+            "avoided": self.edited + self.suppressed,
+        }
 
 
-def record_user_profiles_from_message(message: types.Message):
+notice_coalescer = NoticeCoalescer()
+register_metrics("notices", notice_coalescer.stats)
+
+
+async def record_user_profiles_from_message(message: types.Message):
     """Сохранить информацию об участвующих пользователях для поиска по username."""
     if message.from_user:
-        db.upsert_user_profile(message.from_user)
+        await profile_cache.record(message.from_user)
     if message.reply_to_message and message.reply_to_message.from_user:
-        db.upsert_user_profile(message.reply_to_message.from_user)
+        await profile_cache.record(message.reply_to_message.from_user)
+    for entities in (message.entities, message.caption_entities):
+        for entity in entities or ():
+            if entity.type == "text_mention" and entity.user:
+                await profile_cache.record(entity.user)
 
 
 def extract_mentioned_usernames(message: types.Message) -> list[str]:
@@ -1419,7 +3891,7 @@ def extract_mentioned_usernames(message: types.Message) -> list[str]:
     return usernames
 
 
-def gather_targets_from_message(message: types.Message) -> list[dict]:
+async def gather_targets_from_message(message: types.Message) -> list[dict]:
     """Возвращает список пользователей, которых мог адресовать отправитель (ответ или упоминание)."""
     targets: list[dict] = []
     seen_ids: set[int] = set()
@@ -1444,21 +3916,19 @@ def gather_targets_from_message(message: types.Message) -> list[dict]:
     # Адресат из ответа
     if message.reply_to_message and message.reply_to_message.from_user:
         target_user = message.reply_to_message.from_user
-        db.upsert_user_profile(target_user)
         add_target(target_user.id, target_user.first_name, target_user.username)
 
-    def process_entities(text: str | None, entities: list[types.MessageEntity] | None):
+    async def process_entities(text: str | None, entities: list[types.MessageEntity] | None):
         if not text or not entities:
             return
         for entity in entities:
             if entity.type == "text_mention" and entity.user:
-                db.upsert_user_profile(entity.user)
                 add_target(entity.user.id, entity.user.first_name, entity.user.username)
             elif entity.type == "mention":
                 mention_text = text[entity.offset: entity.offset + entity.length]
                 if mention_text.startswith("@"):
                     username = mention_text[1:]
-                    profile = db.get_user_by_username(username)
+                    profile = await find_user_by_username(username)
                     if profile:
                         add_target(
                             profile["user_id"],
@@ -1468,18 +3938,67 @@ def gather_targets_from_message(message: types.Message) -> list[dict]:
                     else:
                         add_target(None, mention_text, username)
 
-    process_entities(message.text, message.entities)
-    process_entities(message.caption, message.caption_entities)
+    await process_entities(message.text, message.entities)
+    await process_entities(message.caption, message.caption_entities)
 
     return targets
 
 
+class SwearMatcher:
+    """Словарь матов, скомпилированный один раз в префиксное дерево.
+
+    Дерево превращается в одно регулярное выражение, поэтому обход идёт в C за один проход
+    по тексту, а не по подстроке на каждое слово словаря. Латинские/цифровые двойники
+    заменяются таблицей translate, повторы букв ("бляяять") и одиночные вставленные знаки
+    ("х.у.й") допускаются самим шаблоном. Совпадением считается только целое слово.
+    """
+
+    def __init__(self, words):
+        self._table = str.maketrans(SWEAR_HOMOGLYPHS)
+        self._strip_table = str.maketrans("", "", SWEAR_INSERTED_CHARS)
+        # Фразы из нескольких слов никогда не совпадали с одиночным токеном — не включаем их
+        self.lexicon = frozenset(self.normalize(word) for word in words if " " not in word)
+        trie: dict[str, dict] = {}
+        for word in self.lexicon:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        self._separator = f"[{re.escape(SWEAR_INSERTED_CHARS)}]?"
+        self._pattern = re.compile(r"(?<!\w)" + self._compile_node(trie) + r"(?!\w)")
+
+    def normalize(self, word: str) -> str:
+        normalized = word.lower().translate(self._table).translate(self._strip_table)
+        return re.sub(r"(\w)\1+", r"\1", normalized)
+
+    def _compile_node(self, node: dict) -> str:
+        branches = []
+        for char, child in sorted(node.items()):
+            if not char:
+                continue
+            tail = self._compile_node(child)
+            if not tail:
+                branches.append(f"{re.escape(char)}+")
+                continue
+            # После целого слова знак — граница: "сука-блять" это два слова, а не "сукаблять"
+            separator = "" if "" in child else self._separator
+            branches.append(f"{re.escape(char)}+{separator}{tail}")
+        if not branches:
+            return ""
+        group = f"(?:{'|'.join(branches)})"
+        return f"{group}?" if "" in node else group
+
+    def count(self, text: str | None) -> int:
+        if not text:
+            return 0
+        return len(self._pattern.findall(text.lower().translate(self._table)))
+
+
+swear_matcher = SwearMatcher(SWEAR_WORDS)
+
+
 def count_swears_in_text(text: str | None) -> int:
-    if not text:
-        return 0
-    lower_text = text.lower()
-    tokens = WORD_PATTERN.findall(lower_text)
-    return sum(1 for token in tokens if token in SWEAR_WORDS)
+    return swear_matcher.count(text)
 
 
 async def process_swear_stats(message: types.Message):
@@ -1488,79 +4007,127 @@ async def process_swear_stats(message: types.Message):
         if not combined_text_parts:
             return
         joined_text = " \n".join(combined_text_parts)
-        lower_joined = joined_text.lower()
-        if not any(word in lower_joined for word in SWEAR_WORDS):
-            return
         swear_count = count_swears_in_text(joined_text)
         if swear_count > 0:
-            record_user_profiles_from_message(message)
-            db.increment_swear(message.chat.id, message.from_user.id, swear_count)
+            await swear_buffer.add(message.chat.id, message.from_user.id, swear_count)
 
 
-async def send_swear_ranking(message: types.Message):
-    ranking = db.get_swear_ranking(message.chat.id, SWEAR_RANK_ENTRIES)
-    if not ranking:
-        await message.answer("📊 В этом чате пока нет данных по матам.")
+RANKINGS = {
+    "issued": ("🏆 Рейтинг блокировок чата:", "📋 В этом чате нет активных блокировок.", MAX_RANK_ENTRIES),
+    "received": ("🎯 Кого чаще всего блокируют:", "📋 В этом чате нет активных блокировок.", MAX_RANK_ENTRIES),
+    "swear": ("🤬 Топ по матюкам:", "📊 В этом чате пока нет данных по матам.", SWEAR_RANK_ENTRIES),
+}
+
+
+def build_page_keyboard(prev_data: str | None, next_data: str | None) -> InlineKeyboardMarkup | None:
+    buttons = []
+    if prev_data:
+        buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=prev_data))
+    if next_data:
+        buttons.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=next_data))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+def split_page(rows: list, limit: int, cursor: Any, forward: bool) -> tuple[list, bool, bool]:
+    """Обрезает выборку limit+1 до страницы и определяет, есть ли соседние страницы."""
+    has_more = len(rows) > limit
+    if forward:
+        return rows[:limit], cursor is not None, has_more
+    return rows[-limit:], has_more, True
+
+
+async def render_ranking_page(chat_id: int, kind: str, cursor: tuple[int, int] | None = None,
+                              forward: bool = True, page: int = 1) -> tuple[str, InlineKeyboardMarkup | None] | None:
+    """Страница рейтинга: читается limit+1 строк по ключу, имена — только для этой страницы."""
+    title, _, limit = RANKINGS[kind]
+    if kind == "swear":
+        # Рейтинг листается по таблице, поэтому сбрасываем приращения этого чата, если они есть
+        if swear_buffer.has_pending(chat_id):
+            await swear_buffer.flush()
+        rows = await adb.get_swear_ranking_page(chat_id, cursor, forward, limit + 1)
+    else:
+        rows = await adb.get_block_ranking_page(chat_id, kind == "received", cursor, forward, limit + 1)
+    rows, has_prev, has_next = split_page(rows, limit, cursor, forward)
+    if not rows:
+        return None
+    if not has_prev:
+        page = 1
+
+    names = await name_resolver.resolve(chat_id, [user_id for user_id, _ in rows])
+    lines = [f"{title} (стр. {page})\n" if has_prev or has_next else f"{title}\n"]
+    offset = (page - 1) * limit
+    for idx, (user_id, count) in enumerate(rows, start=offset + 1):
+        lines.append(f"{idx}. {names[user_id]} — {count}")
+
+    first_user, first_count = rows[0]
+    last_user, last_count = rows[-1]
+    keyboard = build_page_keyboard(
+        f"rank_{kind}_p_{first_count}_{first_user}_{page - 1}" if has_prev else None,
+        f"rank_{kind}_n_{last_count}_{last_user}_{page + 1}" if has_next else None
+    )
+    return "\n".join(lines), keyboard
+
+
+@send_in_lane("background")
+async def send_ranking(message: types.Message, kind: str):
+    rendered = await render_ranking_page(message.chat.id, kind)
+    if rendered is None:
+        await message.answer(RANKINGS[kind][1])
         return
+    text, keyboard = rendered
+    await message.answer(text, reply_markup=keyboard)
 
-    lines = ["🤬 Топ по матюкам:\n"]
-    for idx, (user_id, count) in enumerate(ranking, start=1):
-        name = await get_chat_user_name(message.chat.id, user_id)
-        lines.append(f"{idx}. {name} — {count}")
 
-    await message.answer("\n".join(lines))
+async def send_swear_ranking(message: types.Message):
+    await send_ranking(message, "swear")
 
 
-async def get_chat_user_name(chat_id: int, user_id: int) -> str:
-    try:
-        member = await bot.get_chat_member(chat_id, user_id)
-        user = member.user
-        if user.full_name:
-            return user.full_name
-        if user.username:
-            return f"@{user.username}"
-    except Exception:
-        pass
-    return f"ID{user_id}"
+async def send_block_ranking(message: types.Message, received: bool = False):
+    await send_ranking(message, "received" if received else "issued")
 
 
-async def send_block_profile(message: types.Message, target_user_id: int, title_name: str | None = None):
-    blocked_ids = db.get_blocks_by_blocker(message.chat.id, target_user_id)
-    display_name = title_name or await get_chat_user_name(message.chat.id, target_user_id)
+async def render_block_profile_page(chat_id: int, target_user_id: int, title_name: str | None = None,
+                                    cursor: int | None = None, forward: bool = True,
+                                    page: int = 1) -> tuple[str, InlineKeyboardMarkup | None] | None:
+    """Страница профиля блокировок; None, если страница опустела (блокировки сняли)."""
+    issued, _ = await adb.get_block_totals(chat_id, target_user_id)
+    rows = await adb.get_blocks_page(chat_id, target_user_id, cursor, forward, BLOCKS_PAGE_SIZE + 1)
+    rows, has_prev, has_next = split_page(rows, BLOCKS_PAGE_SIZE, cursor, forward)
+    if not rows and cursor is not None:
+        return None
+    if not has_prev:
+        page = 1
+
+    blocked_ids = [blocked_id for _, blocked_id in rows]
+    names = await name_resolver.resolve(chat_id, [target_user_id, *blocked_ids])
+    display_name = title_name or names[target_user_id]
     text_lines = [
         f"📊 Профиль блокировок: {display_name}",
-        f"Всего заблокировано: {len(blocked_ids)}"
+        f"Всего заблокировано: {issued}"
     ]
 
     if blocked_ids:
-        text_lines.append("\nЗаблокированы:")
-        for idx, blocked_id in enumerate(blocked_ids, start=1):
-            blocked_name = await get_chat_user_name(message.chat.id, blocked_id)
-            text_lines.append(f"{idx}. {blocked_name}")
+        suffix = f" (стр. {page})" if has_prev or has_next else ""
+        text_lines.append(f"\nЗаблокированы{suffix}:")
+        offset = (page - 1) * BLOCKS_PAGE_SIZE
+        for idx, blocked_id in enumerate(blocked_ids, start=offset + 1):
+            text_lines.append(f"{idx}. {names[blocked_id]}")
     else:
         text_lines.append("\nПока никого не заблокировал(а).")
 
-    await message.answer("\n".join(text_lines))
-
-
-async def send_block_ranking(message: types.Message):
-    blocks = db.get_chat_blocks(message.chat.id)
-    if not blocks:
-        await message.answer("📋 В этом чате нет активных блокировок.")
-        return
-
-    stats: dict[int, int] = {}
-    for blocker_id, _ in blocks:
-        stats[blocker_id] = stats.get(blocker_id, 0) + 1
-
-    ranking = sorted(stats.items(), key=lambda item: (-item[1], item[0]))[:MAX_RANK_ENTRIES]
+    keyboard = None
+    if rows:
+        keyboard = build_page_keyboard(
+            f"blocks_{target_user_id}_p_{rows[0][0]}_{page - 1}" if has_prev else None,
+            f"blocks_{target_user_id}_n_{rows[-1][0]}_{page + 1}" if has_next else None
+        )
+    return "\n".join(text_lines), keyboard
 
-    lines = ["🏆 Рейтинг блокировок чата:\n"]
-    for idx, (user_id, count) in enumerate(ranking, start=1):
-        name = await get_chat_user_name(message.chat.id, user_id)
-        lines.append(f"{idx}. {name} — {count}")
 
-    await message.answer("\n".join(lines))
+@send_in_lane("background")
+async def send_block_profile(message: types.Message, target_user_id: int, title_name: str | None = None):
+    text, keyboard = await render_block_profile_page(message.chat.id, target_user_id, title_name)
+    await message.answer(text, reply_markup=keyboard)
 
 
 def remove_target_mentions(text: str, targets: list[dict]) -> str:
@@ -1613,7 +4180,7 @@ async def resolve_targets_with_fetch(chat_id: int, targets: list[dict]):
         target["user_id"] = resolved_user.id
         target["name"] = resolved_user.first_name or getattr(resolved_user, "full_name", None) or target.get("name") or username_with_at
         target["username"] = resolved_user.username or username
-        db.upsert_user_profile(resolved_user)
+        await profile_cache.record(resolved_user)
 
 # ==================== Обработчики команд ====================
 
@@ -1628,7 +4195,7 @@ async def on_bot_added(event: types.ChatMemberUpdated):
         "📝 Доступные команды:\n"
         "• Ответьте на сообщение пользователя командой 'Спринг стоп' для блокировки\n"
         "• 'Спринг стоп' + текст для установки персонального автоответчика\n"
-        "• 'Спринг список' для просмотра блокировок в чате\n"
+        "• 'Спринг список' для просмотра блокировок в чате, 'Спринг список жертвы' — кого блокируют чаще всех\n"
         "• 'Топ маты' / 'Топ матов' для рейтинга по количеству матов\n"
         "• 'Спринг стоп все' для включения/выключения режима и указания персонального автоответчика (либо глобального в ЛС)\n"
         "• Командой 'Спринг стоп' по конкретному пользователю можно убрать его из общего блок-листа\n"
@@ -1663,14 +4230,18 @@ async def cmd_list(message: types.Message):
     text = message.text.strip()
     lower_text = text.lower()
 
-    record_user_profiles_from_message(message)
-    targets = gather_targets_from_message(message)
+    await record_user_profiles_from_message(message)
+    targets = await gather_targets_from_message(message)
     await resolve_targets_with_fetch(message.chat.id, targets)
 
     if lower_text.startswith("спринг список мой"):
         await send_block_profile(message, message.from_user.id)
         return
 
+    if lower_text.startswith("спринг список жертвы"):
+        await send_block_ranking(message, received=True)
+        return
+
     if targets:
         target = targets[0]
         target_id = target.get("user_id")
@@ -1701,8 +4272,8 @@ async def cmd_joy_stop(message: types.Message):
         return
     
     blocker_id = message.from_user.id
-    record_user_profiles_from_message(message)
-    targets = gather_targets_from_message(message)
+    await record_user_profiles_from_message(message)
+    targets = await gather_targets_from_message(message)
     await resolve_targets_with_fetch(message.chat.id, targets)
     text = message.text
     text_lower = text.lower()
@@ -1714,12 +4285,12 @@ async def cmd_joy_stop(message: types.Message):
     tail_lower = text_lower[cmd_pos:].lstrip()
 
     # Обработка режима "Спринг стоп все"
-    global_block_enabled, global_block_message = db.get_global_block(message.chat.id, blocker_id)
+    global_block_enabled, global_block_message = db.block_index.get_global_block(message.chat.id, blocker_id)
 
     if tail_lower.startswith("спринг стоп все"):
         remaining_text = text[cmd_pos + len("спринг стоп все"):]
         global_message = extract_personal_message(remaining_text, targets)
-        enabled = db.toggle_global_block(message.chat.id, blocker_id, global_message)
+        enabled = await adb.toggle_global_block(message.chat.id, blocker_id, global_message)
         blocker_name = message.from_user.first_name
         if enabled:
             if global_message:
@@ -1762,7 +4333,7 @@ async def cmd_joy_stop(message: types.Message):
 
     # Если включен "Спринг стоп все", то команда работает как исключение
     if global_block_enabled:
-        allowed = db.toggle_global_block_exception(message.chat.id, blocker_id, blocked_id)
+        allowed = await adb.toggle_global_block_exception(message.chat.id, blocker_id, blocked_id)
         blocker_name = message.from_user.first_name
         if allowed:
             response = (
@@ -1776,7 +4347,7 @@ async def cmd_joy_stop(message: types.Message):
         return
 
     # Переключаем блокировку
-    is_blocked = db.toggle_block(
+    is_blocked = await adb.toggle_block(
         message.chat.id,
         blocker_id,
         blocked_id,
@@ -1809,22 +4380,29 @@ async def cmd_swear_top(message: types.Message):
         await message.answer("Команда работает только в групповых чатах.")
         return
 
-async def maybe_reply_with_ai(message: types.Message, targets: list[dict] | None = None) -> None:
-    if not message.from_user or message.from_user.is_bot:
-        return
-    if not (message.text or message.caption):
-        return
-
-    replied_to_bot = (
+def is_replied_to_bot(message: types.Message) -> bool:
+    return bool(
         message.reply_to_message
         and message.reply_to_message.from_user
         and BOT_ID is not None
         and message.reply_to_message.from_user.id == BOT_ID
     )
-    mentioned_bot = message_mentions_bot(message)
 
-    if not replied_to_bot and not mentioned_bot:
+
+def is_addressed_to_bot(message: types.Message) -> bool:
+    """Дешёвая проверка до постановки в полосу ИИ: текст от человека с ответом боту или упоминанием."""
+    if not message.from_user or message.from_user.is_bot:
+        return False
+    if not (message.text or message.caption):
+        return False
+    return is_replied_to_bot(message) or message_mentions_bot(message)
+
+
+@send_in_lane("background")
+async def maybe_reply_with_ai(message: types.Message, targets: list[dict] | None = None) -> None:
+    if not is_addressed_to_bot(message):
         return
+    replied_to_bot = is_replied_to_bot(message)
 
     if not await ensure_group_subscription(message):
         return
@@ -1838,11 +4416,12 @@ async def maybe_reply_with_ai(message: types.Message, targets: list[dict] | None
         return
 
     if targets is None:
-        targets = gather_targets_from_message(message)
+        targets = await gather_targets_from_message(message)
 
     history_entries = get_chat_history_entries(message.chat.id)
-    chat_memories = db.get_chat_memories(message.chat.id, CHAT_MEMORY_CONTEXT_LIMIT)
-    user_memory_context = build_user_memory_context(message.chat.id, targets)
+    memory_query = build_memory_query(message.text or message.caption)
+    chat_memories = await adb.search_chat_memories(message.chat.id, memory_query, CHAT_MEMORY_CONTEXT_LIMIT)
+    user_memory_context = await build_user_memory_context(message.chat.id, targets, memory_query)
     reply_text = await generate_ai_reply(message, history_entries, chat_memories, user_memory_context)
     if not reply_text:
         return
@@ -1856,24 +4435,44 @@ async def maybe_reply_with_ai(message: types.Message, targets: list[dict] | None
 @dp.message((F.chat.type == "group") | (F.chat.type == "supergroup"))
 @dp.message((F.chat.type == "group") | (F.chat.type == "supergroup"))
 async def check_reply_block(message: types.Message):
-    """Проверка сообщений на попытку связаться с пользователем, который ограничил ответы."""
+    """Проверка сообщений на попытку связаться с пользователем, который ограничил ответы.
+
+    Сначала выполняется блокировка (удаление + уведомление), остальное уходит в фоновые полосы.
+    """
     if not message.from_user:
         return
 
+    started = time.perf_counter()
     store_chat_history(message)
+    targets = await gather_targets_from_message(message)
+    enforced = await enforce_reply_block(message, targets)
+    stage_timings.record("enforcement", time.perf_counter() - started)
+
+    stats_lane.submit(lambda: record_message_stats(message))
+    if enforced:
+        return
+    schedule_memory_capture(message, targets)
+    if is_addressed_to_bot(message):
+        ai_lane.submit(lambda: maybe_reply_with_ai(message, targets))
 
+
+async def record_message_stats(message: types.Message) -> None:
+    await record_user_profiles_from_message(message)
     await process_swear_stats(message)
 
-    record_user_profiles_from_message(message)
-    targets = gather_targets_from_message(message)
-    schedule_memory_capture(message, targets)
 
-    await maybe_reply_with_ai(message, targets)
+@send_in_lane("normal")
+async def send_block_notice(message: types.Message, blocker_id: int, text: str) -> None:
+    await notice_coalescer.notify(message, blocker_id, text)
 
+
+@send_in_lane("critical")
+async def enforce_reply_block(message: types.Message, targets: list[dict]) -> bool:
+    """Удаляет ответ заблокированного пользователя. Возвращает True, если сообщение попало под блок."""
     replier_id = message.from_user.id
 
-    if not targets:
-        return
+    if not targets or not db.block_index.has_blockers(message.chat.id):
+        return False
 
     blocked_target = None
     blocker_id = None
@@ -1884,14 +4483,7 @@ async def check_reply_block(message: types.Message):
         if not target_id:
             continue
 
-        global_block_enabled, global_block_message = db.get_global_block(message.chat.id, target_id)
-        if global_block_enabled and not db.is_global_block_exception(message.chat.id, target_id, replier_id):
-            blocked_target = target
-            blocker_id = target_id
-            personal_message = global_block_message
-            break
-
-        is_blocked, personal_msg = db.is_blocked(message.chat.id, target_id, replier_id)
+        is_blocked, personal_msg = db.block_index.find_block(message.chat.id, target_id, replier_id)
         if is_blocked:
             blocked_target = target
             blocker_id = target_id
@@ -1899,29 +4491,37 @@ async def check_reply_block(message: types.Message):
             break
 
     if not blocked_target:
-        return
-
-    try:
-        await message.delete()
-
-        autoresponder = personal_message or db.get_global_autoresponder(blocker_id)
-        if not autoresponder:
-            autoresponder = "Пользователь установил ограничение на ответы к своим сообщениям."
+        return False
 
-        replier_mention = message.from_user.mention_html()
-        target_name = blocked_target.get("name") or "этот пользователь"
-        text = (
-            f"{replier_mention}, {html.escape(target_name)} установил(а) для вас следующий ответ:\n\n"
-            f"\"{html.escape(autoresponder)}\""
-        )
+    # Удаление не ждём под замком чата: следующие ответы в этом чате попадут в ту же пачку
+    deletion = deletion_batcher.submit(message.chat.id, message.message_id)
+    notice_lane.submit(lambda: finish_reply_block(message, deletion, blocked_target, blocker_id, personal_message))
+    return True
 
-        await send_temp_answer(message, text, parse_mode="HTML")
 
+async def finish_reply_block(message: types.Message, deletion: asyncio.Future, blocked_target: dict,
+                             blocker_id: int, personal_message: str | None) -> None:
+    """Дожидается удаления заблокированного ответа и отправляет уведомление (или предупреждение)."""
+    try:
+        await deletion
     except Exception as e:
         logger.error(f"Ошибка при обработке заблокированного сообщения: {e}")
         await message.answer(
             "⚠️ Не удалось удалить сообщение. Убедитесь, что бот является администратором с правом удаления сообщений."
         )
+        return
+
+    autoresponder = personal_message or await get_global_autoresponder(blocker_id)
+    if not autoresponder:
+        autoresponder = "Пользователь установил ограничение на ответы к своим сообщениям."
+
+    replier_mention = message.from_user.mention_html()
+    target_name = blocked_target.get("name") or "этот пользователь"
+    text = (
+        f"{replier_mention}, {html.escape(target_name)} установил(а) для вас следующий ответ:\n\n"
+        f"\"{html.escape(autoresponder)}\""
+    )
+    await send_block_notice(message, blocker_id, text)
 
 # ==================== Обработчики для личных сообщений ====================
 
@@ -1936,7 +4536,7 @@ async def global_autoresponder_menu(message: types.Message, state: FSMContext):
     # Очищаем любое предыдущее состояние
     await state.clear()
     
-    current = db.get_global_autoresponder(message.from_user.id)
+    current = await get_global_autoresponder(message.from_user.id)
     
     text = "✍️ Глобальный автоответчик\n\n"
     if current:
@@ -1971,7 +4571,7 @@ async def save_global_autoresponder(message: types.Message, state: FSMContext):
         await message.answer("❌ Отменено.", reply_markup=get_main_keyboard())
         return
     
-    db.set_global_autoresponder(message.from_user.id, message.text)
+    await set_global_autoresponder(message.from_user.id, message.text)
     await state.clear()
     await message.answer(
         "✅ Глобальный автоответчик успешно установлен!",
@@ -2019,7 +4619,7 @@ async def save_support_message(message: types.Message, state: FSMContext):
         await message.answer("❌ Отменено.", reply_markup=get_main_keyboard())
         return
     
-    ban_info = db.get_support_ban(message.from_user.id)
+    ban_info = await adb.get_support_ban(message.from_user.id)
     if ban_info and ban_info["block_all"]:
         await message.answer(
             "",
@@ -2033,7 +4633,7 @@ async def save_support_message(message: types.Message, state: FSMContext):
         return
 
     # Проверка антиспама
-    can_send, wait_time = db.can_send_support_message(message.from_user.id, cooldown_seconds=30)
+    can_send, wait_time = await adb.can_send_support_message(message.from_user.id, cooldown_seconds=30)
     if not can_send:
         await message.answer(
             f"⏰ Пожалуйста, подождите {wait_time} сек. перед отправкой следующего сообщения.",
@@ -2044,7 +4644,7 @@ async def save_support_message(message: types.Message, state: FSMContext):
 
     # Сохраняем в БД
     stored_text = message.text or message.caption or f"<{message.content_type}>"
-    db.save_support_message(message.from_user.id, stored_text)
+    await adb.save_support_message(message.from_user.id, stored_text)
 
     # Отправляем администратору, если ID указан
     if ADMIN_ID:
@@ -2055,7 +4655,7 @@ async def save_support_message(message: types.Message, state: FSMContext):
                 user_info += f" (@{message.from_user.username})"
             user_info += f"\nID: {message.from_user.id}"
 
-            keyboard = build_support_admin_keyboard(message.from_user.id)
+            keyboard = await build_support_admin_keyboard(message.from_user.id)
 
             header_lines = ["📩 Новое сообщение в тех.поддержку:", "", user_info]
             if message.text:
@@ -2110,7 +4710,7 @@ async def help_menu(message: types.Message, state: FSMContext):
         "Напишите команду 'Спринг стоп' и с новой строки ваш текст автоответчика. "
         "Этот текст будет показываться заблокированному пользователю при попытке ответить вам.\n\n"
         "3️⃣ Спринг список\n"
-        "Показывает список всех блокировок в текущем чате.\n\n"
+        "Показывает рейтинг блокировок в текущем чате. 'Спринг список жертвы' — кого блокируют чаще всех.\n\n"
         "4️⃣ Топ маты / Топ матов\n"
         "Выводит рейтинг пользователей чата по количеству зафиксированных матов.\n\n"
         "⚙️ Настройки и ИИ в личных сообщениях:\n\n"
@@ -2160,9 +4760,9 @@ async def style_menu(message: types.Message):
         return
 
     user_id = message.from_user.id
-    personal = get_user_style(user_id)
-    personal_prompt = get_user_custom_prompt(user_id) if personal == CUSTOM_STYLE_KEY else None
-    default_style = get_default_ai_style()
+    personal = await get_user_style(user_id)
+    personal_prompt = await get_user_custom_prompt(user_id) if personal == CUSTOM_STYLE_KEY else None
+    default_style = await get_default_ai_style()
     effective = personal or default_style
     effective_title = AI_STYLE_PRESETS.get(effective, {"title": "Неизвестно"})["title"]
     if personal == CUSTOM_STYLE_KEY:
@@ -2195,7 +4795,7 @@ async def change_style(callback: types.CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
 
     if data == "style_me_reset":
-        reset_user_style(user_id)
+        await reset_user_style(user_id)
         await callback.message.edit_reply_markup(reply_markup=build_personal_style_keyboard(None))
         await callback.answer("Личный стиль сброшен")
         return
@@ -2214,7 +4814,7 @@ async def change_style(callback: types.CallbackQuery, state: FSMContext):
         if style_key not in AI_STYLE_PRESETS:
             await callback.answer("Неизвестный стиль")
             return
-        set_user_style(user_id, style_key)
+        await set_user_style(user_id, style_key)
         await callback.message.edit_reply_markup(reply_markup=build_personal_style_keyboard(style_key))
         await callback.answer("Личный стиль обновлён")
         return
@@ -2228,7 +4828,7 @@ async def change_style(callback: types.CallbackQuery, state: FSMContext):
         if style_key not in AI_STYLE_PRESETS:
             await callback.answer("Неизвестный стиль")
             return
-        set_default_ai_style(style_key)
+        await set_default_ai_style(style_key)
         await callback.message.edit_reply_markup(reply_markup=build_default_style_keyboard(style_key))
         await callback.answer("Стиль бота обновлён")
         return
@@ -2246,8 +4846,8 @@ async def change_style(callback: types.CallbackQuery, state: FSMContext):
         await message.answer(error)
         return
 
-    set_user_custom_prompt(message.from_user.id, text)
-    set_user_style(message.from_user.id, CUSTOM_STYLE_KEY)
+    await set_user_custom_prompt(message.from_user.id, text)
+    await set_user_style(message.from_user.id, CUSTOM_STYLE_KEY)
     await state.clear()
     await message.answer(
         "✅ Кастомный стиль сохранён. Теперь я буду отвечать по твоим правилам.",
@@ -2316,6 +4916,16 @@ async def send_admin_reply(message: types.Message, state: FSMContext):
     await state.clear()
 
 
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    """Метрики производительности (только администратору в личке)"""
+    if message.chat.type != "private":
+        return
+    if not ADMIN_ID or str(message.from_user.id) != str(ADMIN_ID):
+        return
+    await message.answer(format_metrics_report())
+
+
 @dp.callback_query(F.data.startswith("support_media_"))
 async def toggle_support_media(callback: types.CallbackQuery):
     if not ADMIN_ID or str(callback.from_user.id) != str(ADMIN_ID):
@@ -2323,10 +4933,54 @@ async def toggle_support_media(callback: types.CallbackQuery):
         return
 
     user_id = int(callback.data.split("_")[-1])
-    new_state = db.toggle_support_media_ban(user_id)
+    new_state = await adb.toggle_support_media_ban(user_id)
     text = "Медиа запрещены" if new_state else "Медиа снова разрешены"
     await callback.answer(text)
-    await callback.message.edit_reply_markup(reply_markup=build_support_admin_keyboard(user_id))
+    await callback.message.edit_reply_markup(reply_markup=await build_support_admin_keyboard(user_id))
+
+
+async def show_page(callback: types.CallbackQuery, rendered: tuple[str, InlineKeyboardMarkup | None]) -> None:
+    text, keyboard = rendered
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as exc:
+        if "message is not modified" not in str(exc):
+            raise
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("rank_"))
+async def paginate_ranking(callback: types.CallbackQuery):
+    _, kind, direction, value, user_id, page = callback.data.split("_")
+    if kind not in RANKINGS or not callback.message:
+        await callback.answer()
+        return
+    chat_id = callback.message.chat.id
+    forward = direction == "n"
+    rendered = await render_ranking_page(chat_id, kind, (int(value), int(user_id)), forward, int(page))
+    if rendered is None and not forward:
+        rendered = await render_ranking_page(chat_id, kind)
+    if rendered is None:
+        await callback.answer("Дальше записей нет")
+        return
+    await show_page(callback, rendered)
+
+
+@dp.callback_query(F.data.startswith("blocks_"))
+async def paginate_block_profile(callback: types.CallbackQuery):
+    _, target_user_id, direction, cursor, page = callback.data.split("_")
+    if not callback.message:
+        await callback.answer()
+        return
+    chat_id = callback.message.chat.id
+    forward = direction == "n"
+    rendered = await render_block_profile_page(chat_id, int(target_user_id), None, int(cursor), forward, int(page))
+    if rendered is None and not forward:
+        rendered = await render_block_profile_page(chat_id, int(target_user_id))
+    if rendered is None:
+        await callback.answer("Дальше записей нет")
+        return
+    await show_page(callback, rendered)
 
 
 @dp.callback_query(F.data == "check_subscription")
@@ -2334,7 +4988,7 @@ async def check_subscription(callback: types.CallbackQuery):
     if not REQUIRED_CHANNEL:
         await callback.answer("Подписка не требуется", show_alert=True)
         return
-    if await is_user_subscribed(callback.from_user.id):
+    if await recheck_subscription(callback.from_user.id):
         await callback.answer("Подписка подтверждена!", show_alert=True)
         await callback.message.answer(WELCOME_TEXT, reply_markup=get_main_keyboard())
     else:
@@ -2348,10 +5002,10 @@ async def toggle_support_full(callback: types.CallbackQuery):
         return
 
     user_id = int(callback.data.split("_")[-1])
-    new_state = db.toggle_support_full_ban(user_id)
+    new_state = await adb.toggle_support_full_ban(user_id)
     text = "Пользователь заблокирован в поддержке" if new_state else "Пользователь снова может писать"
     await callback.answer(text)
-    await callback.message.edit_reply_markup(reply_markup=build_support_admin_keyboard(user_id))
+    await callback.message.edit_reply_markup(reply_markup=await build_support_admin_keyboard(user_id))
 
 # ==================== Запуск бота ====================
 async def init_bot_identity():
@@ -2363,10 +5017,270 @@ async def init_bot_identity():
     BOT_USERNAME = me.username
 
 
+background_tasks: list[asyncio.Task] = []
+
+
+async def on_startup():
+    openrouter_client.get_session()
+    await detect_subscription_events()
+    task_supervisor.start()
+    await deletion_scheduler.start()
+    background_tasks.append(
+        asyncio.create_task(run_periodically("swear_stats", SWEAR_BUFFER_FLUSH_INTERVAL, swear_buffer.flush))
+    )
+    background_tasks.append(
+        asyncio.create_task(run_periodically("user_profiles", PROFILE_BUFFER_FLUSH_INTERVAL, profile_cache.flush))
+    )
+    background_tasks.append(
+        asyncio.create_task(run_periodically("memory_batches", MEMORY_BATCH_CHECK_INTERVAL, memory_batcher.flush_due))
+    )
+    background_tasks.append(
+        asyncio.create_task(run_periodically("fsm", FSM_FLUSH_INTERVAL, fsm_storage.flush))
+    )
+    background_tasks.append(
+        asyncio.create_task(run_periodically("shared_state", SHARED_STATE_PURGE_INTERVAL, shared_store.purge_expired))
+    )
+
+
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    leftovers = await task_supervisor.stop()
+    await deletion_scheduler.stop()
+    await deletion_batcher.close()
+    for records in leftovers.get("memory", []):
+        try:
+            await store_structured_memories(records, extract=False)
+        except Exception as exc:
+            logger.error(f"Не удалось сохранить память при остановке: {exc}")
+    await memory_batcher.flush_all()
+    try:
+        await swear_buffer.flush()
+    except Exception as exc:
+        logger.error(f"Не удалось сохранить статистику матов при остановке: {exc}")
+    try:
+        await profile_cache.flush()
+    except Exception as exc:
+        logger.error(f"Не удалось сохранить профили пользователей при остановке: {exc}")
+    await openrouter_client.close()
+    await shared_store.close()
+    await send_scheduler.close()
+
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+
+def install_stop_signals() -> asyncio.Event:
+    """Событие, которое выставляется по SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    return stop_event
+
+
+async def serve_webhook(app: web.Application) -> None:
+    """Запускает aiohttp-приложение, регистрирует webhook и ждёт сигнала остановки."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook слушает http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+    stop_event = install_stop_signals()
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Остановка webhook-сервера...")
+        await runner.cleanup()
+
+
+async def run_webhook():
+    """Webhook-сервер на aiohttp: апдейт подтверждается сразу, обработка идёт в фоне."""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    await serve_webhook(app)
+
+
+# ==================== Многопроцессный режим ====================
+def run_worker(index: int, workers: int, inbox, outbox) -> None:
+    """Точка входа процесса-воркера: обрабатывает апдейты своего шарда."""
+    asyncio.run(worker_loop(index, workers, inbox, outbox))
+
+
+async def worker_loop(index: int, workers: int, inbox, outbox) -> None:
+    global WORKER_INDEX, shard_ring
+    WORKER_INDEX = index
+    shard_ring = ConsistentHashRing(workers)
+    invalidation_bus.attach(outbox)
+    await init_bot_identity()
+    await dp.emit_startup(bot=bot)
+    logger.info(f"Воркер {index} из {workers} запущен")
+
+    loop = asyncio.get_running_loop()
+    tasks: set[asyncio.Task] = set()
+    try:
+        while True:
+            item = await loop.run_in_executor(None, inbox.get)
+            if item is None:
+                break
+            kind, payload = item
+            if kind == "update":
+                task = asyncio.create_task(dp.feed_raw_update(bot, payload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            elif kind == "invalidate":
+                try:
+                    await invalidation_bus.apply(*payload)
+                except Exception as exc:
+                    logger.warning(f"Не удалось применить инвалидацию {payload}: {exc}")
+    finally:
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        adb.close()
+        db.close()
+
+
+async def fan_out_invalidations(outbox, inboxes) -> None:
+    """Пересылает инвалидации от воркера всем остальным воркерам."""
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await loop.run_in_executor(None, outbox.get)
+        if item is None:
+            return
+        origin, kind, key = item
+        for index, inbox in enumerate(inboxes):
+            if index != origin:
+                inbox.put(("invalidate", (kind, key)))
+
+
+async def receive_by_polling(route: Callable[[dict], None]) -> None:
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    backoff = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=SHARD_POLL_TIMEOUT, allowed_updates=allowed_updates)
+        except TelegramRetryAfter as exc:
+            logger.warning(f"Flood limit на getUpdates, повтор через {exc.retry_after} с")
+            await asyncio.sleep(exc.retry_after)
+            continue
+        except Exception as exc:
+            logger.warning(f"Ошибка получения апдейтов ({type(exc).__name__}): {exc}; повтор через {backoff:.0f} с")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, SHARD_POLL_BACKOFF_MAX)
+            continue
+        backoff = 1.0
+        for update in updates:
+            route(update.model_dump(mode="json", by_alias=True, exclude_unset=True))
+            offset = update.update_id + 1
+
+
+async def supervise_receiver(route: Callable[[dict], None], stop: asyncio.Event) -> None:
+    """Держит receive_by_polling запущенным до сигнала остановки: упавшую задачу перезапускает."""
+    stopping = asyncio.create_task(stop.wait())
+    try:
+        while True:
+            receiver = asyncio.create_task(receive_by_polling(route))
+            await asyncio.wait({receiver, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            if stopping.done():
+                receiver.cancel()
+                await asyncio.gather(receiver, return_exceptions=True)
+                return
+            error = "отменён" if receiver.cancelled() else receiver.exception()
+            logger.error(f"Приём апдейтов остановился ({error!r}), перезапуск")
+            await asyncio.sleep(1)
+    finally:
+        stopping.cancel()
+
+
+def build_routing_app(route: Callable[[dict], None]) -> web.Application:
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET
+        ):
+            return web.Response(status=401)
+        route(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    return app
+
+
+async def run_sharded(workers: int) -> None:
+    """Процесс-приёмник: получает апдейты и раздаёт их воркерам по консистентному хешу chat_id."""
+    context = multiprocessing.get_context("spawn")
+    outbox = context.Queue()
+    inboxes = [context.Queue() for _ in range(workers)]
+    processes = [
+        context.Process(target=run_worker, args=(index, workers, inboxes[index], outbox), name=f"joyguard-worker-{index}")
+        for index in range(workers)
+    ]
+    # Ctrl+C получает вся группа процессов: воркеры стартуют с игнорируемым SIGINT
+    # и останавливаются только по команде приёмника
+    previous_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        for process in processes:
+            process.start()
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+    ring = ConsistentHashRing(workers)
+
+    def route(raw_update: dict) -> None:
+        inboxes[ring.node_for(update_shard_key(raw_update))].put(("update", raw_update))
+
+    fan_out = asyncio.create_task(fan_out_invalidations(outbox, inboxes))
+    logger.info(f"Приёмник запущен, воркеров: {workers}")
+    try:
+        if BOT_MODE == "webhook":
+            await serve_webhook(build_routing_app(route))
+        else:
+            await supervise_receiver(route, install_stop_signals())
+    finally:
+        for inbox in inboxes:
+            inbox.put(None)
+        loop = asyncio.get_running_loop()
+        for process in processes:
+            await loop.run_in_executor(None, process.join, SHARD_WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        outbox.put(None)
+        await fan_out
+        await bot.session.close()
+
+
 async def main():
     logger.info("Запуск JoyGuard...")
     await init_bot_identity()
-    await dp.start_polling(bot)
+    try:
+        if BOT_WORKERS > 1:
+            await run_sharded(BOT_WORKERS)
+        elif BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await dp.start_polling(bot, handle_as_tasks=True)
+    finally:
+        adb.close()
+        db.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "123456:" + "A" * 35)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+# joyguard открывает joyguard.db в текущем каталоге при импорте
+os.chdir(tempfile.mkdtemp(prefix="joyguard-tests-"))
+
+import joyguard  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    return joyguard.Database(str(tmp_path / "test.db"))
@@ -0,0 +1,52 @@
+import pytest
+
+import joyguard
+
+CHAT_ID = -100123
+
+
+@pytest.mark.parametrize("query", ["кошки", "обожаю", "Васю", "котики"])
+def test_inflected_query_finds_note(database, query):
+    database.add_memories_batch(
+        [
+            (CHAT_ID, None, 1, "U1", "Вася обожает котиков и кошек"),
+            (CHAT_ID, None, 1, "U1", "Петя работает программистом в банке"),
+        ],
+        []
+    )
+    for index in range(10):
+        database.add_chat_memory(CHAT_ID, None, 2, "U2", f"обсуждали погоду {index}")
+
+    found = database.search_chat_memories(CHAT_ID, joyguard.build_memory_query(query), 3)
+
+    assert "Вася обожает котиков и кошек" in found
+
+
+def test_stop_words_are_not_query_terms():
+    assert joyguard.build_memory_query("что там про кто") is None
+    assert joyguard.build_memory_query("что там с рыбалкой") == '"рыбалк"*'
+
+
+def test_search_is_scoped_to_chat_and_subject(database):
+    database.add_memories_batch(
+        [(CHAT_ID, None, 1, "U1", "любит рыбалку"), (CHAT_ID - 1, None, 1, "U1", "рыбалка в другом чате")],
+        [(CHAT_ID, 7, 1, "ездит на рыбалку"), (CHAT_ID, 8, 1, "рыбак со стажем")]
+    )
+    query = joyguard.build_memory_query("рыбалка")
+
+    assert database.search_chat_memories(CHAT_ID, query, 5) == ["любит рыбалку"]
+    assert database.search_user_memories(CHAT_ID, 7, query, 5) == ["ездит на рыбалку"]
+
+
+def test_relevant_old_note_beats_recent_noise(database):
+    database.add_chat_memory(CHAT_ID, None, 1, "U1", "Маша собирается в отпуск в Турцию")
+    database.get_connection().execute(
+        "UPDATE chat_memories SET created_at = datetime('now', '-30 days')"
+    ).connection.commit()
+    for index in range(20):
+        database.add_chat_memory(CHAT_ID, None, 2, "U2", f"мем про котиков {index}")
+
+    found = database.search_chat_memories(CHAT_ID, joyguard.build_memory_query("как там отпуск?"), 3)
+
+    assert found[0] == "мем про котиков 19"
+    assert "Маша собирается в отпуск в Турцию" in found
@@ -0,0 +1,70 @@
+import joyguard
+
+CHAT_ID = -100123
+LIMIT = 3
+
+
+def walk_forward(fetch):
+    pages, cursor = [], None
+    while True:
+        rows, _, has_next = joyguard.split_page(fetch(cursor, True, LIMIT + 1), LIMIT, cursor, True)
+        pages.append(rows)
+        if not has_next:
+            return pages
+        cursor = rows[-1]
+
+
+def walk_back(fetch, cursor):
+    pages = []
+    while True:
+        rows, has_prev, _ = joyguard.split_page(fetch(cursor, False, LIMIT + 1), LIMIT, cursor, False)
+        pages.append(rows)
+        if not has_prev:
+            return pages[::-1]
+        cursor = rows[0]
+
+
+def ranking_fetch(database):
+    def fetch(cursor, forward, limit):
+        # Ключ страницы — (значение, user_id), как в callback_data кнопок рейтинга
+        key = (cursor[1], cursor[0]) if cursor else None
+        return database.get_swear_ranking_page(CHAT_ID, key, forward, limit)
+    return fetch
+
+
+def test_ranking_pages_follow_order_with_ties(database):
+    counts = {1: 5, 2: 3, 3: 3, 4: 3, 5: 2, 6: 1, 7: 1, 8: 7}
+    database.increment_swear_batch([(CHAT_ID, user_id, count) for user_id, count in counts.items()])
+    database.increment_swear_batch([(CHAT_ID + 1, 9, 100)])
+    expected = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+    pages = walk_forward(ranking_fetch(database))
+
+    assert [len(page) for page in pages] == [3, 3, 2]
+    assert [row for page in pages for row in page] == expected
+    assert walk_back(ranking_fetch(database), pages[-1][0]) == pages[:-1]
+
+
+def test_block_ranking_counts_issued_and_received(database):
+    for blocker_id, blocked_id in [(1, 2), (1, 3), (1, 4), (2, 3), (4, 3)]:
+        database.toggle_block(CHAT_ID, blocker_id, blocked_id)
+    database.toggle_block(CHAT_ID, 1, 4)
+
+    assert database.get_block_ranking_page(CHAT_ID, False, None, True, 10) == [(1, 2), (2, 1), (4, 1)]
+    assert database.get_block_ranking_page(CHAT_ID, True, None, True, 10) == [(3, 3), (2, 1)]
+    assert database.get_block_totals(CHAT_ID, 1) == (2, 0)
+
+
+def test_blocks_pages_follow_creation_order(database):
+    blocked_ids = [30, 10, 50, 20, 40, 60, 70]
+    for blocked_id in blocked_ids:
+        database.toggle_block(CHAT_ID, 1, blocked_id)
+    database.toggle_block(CHAT_ID, 2, 80)
+
+    def fetch(cursor, forward, limit):
+        return database.get_blocks_page(CHAT_ID, 1, cursor[0] if cursor else None, forward, limit)
+
+    pages = walk_forward(fetch)
+
+    assert [[blocked_id for _, blocked_id in page] for page in pages] == [[30, 10, 50], [20, 40, 60], [70]]
+    assert walk_back(fetch, pages[-1][0]) == pages[:-1]
@@ -0,0 +1,24 @@
+import pytest
+
+import joyguard
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("сука-блять", 2),
+    ("сука блять", 2),
+    ("сукаблять", 1),
+    ("пиздец-нахуй", 2),
+    ("х.у.й знает", 1),
+    ("бляяять ну почему", 1),
+    ("cyka", 1),
+    ("скиньте ссылку на стрим", 0),
+])
+def test_count(text, expected):
+    assert joyguard.swear_matcher.count(text) == expected
+
+
+def test_hyphenated_pairs_count_as_separate_words():
+    words = sorted(word for word in joyguard.SWEAR_WORDS if " " not in word)
+    for first in words:
+        for second in words:
+            assert joyguard.swear_matcher.count(f"{first}-{second}") == 2, f"{first}-{second}"
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+import joyguard
+
+
+def test_get_or_load_coalesces_concurrent_loads():
+    cache = joyguard.TTLCache("test", 8, 60)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(10)))
+
+    assert asyncio.run(scenario()) == ["value"] * 10
+    assert calls == 1
+    assert cache.coalesced == 9
+    assert cache.get("key") == "value"
+
+
+def test_loader_error_reaches_every_waiter_and_is_not_cached():
+    cache = joyguard.TTLCache("test", 8, 60)
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert not cache.loading("key")
+    assert cache.get("key") is None
+
+
+def test_set_during_load_wins():
+    cache = joyguard.TTLCache("test", 8, 60)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def loader():
+            await release.wait()
+            return "stale"
+
+        task = asyncio.create_task(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        cache.set("key", "fresh")
+        release.set()
+        return await task
+
+    assert asyncio.run(scenario()) == "stale"
+    assert cache.get("key") == "fresh"
+
+
+def test_waiter_loads_itself_when_loading_task_is_cancelled():
+    cache = joyguard.TTLCache("test", 8, 60)
+
+    async def scenario():
+        async def slow():
+            await asyncio.sleep(10)
+            return "never"
+
+        async def fast():
+            return "loaded"
+
+        owner = asyncio.create_task(cache.get_or_load("key", slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_load("key", fast))
+        await asyncio.sleep(0)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return await waiter
+
+    assert asyncio.run(scenario()) == "loaded"
+    assert cache.get("key") == "loaded"
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(joyguard.time, "monotonic", lambda: now[0])
+    cache = joyguard.TTLCache("test", 8, lambda value: 5 if value else 1)
+    cache.set("hit", "value")
+    cache.set("miss", None)
+
+    now[0] += 2
+    assert cache.get("hit") == "value"
+    assert cache.get("miss", "gone") == "gone"
+
+    now[0] += 4
+    assert cache.get("hit") is None
+    assert cache.expirations == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = joyguard.TTLCache("test", 2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1